@@ -1,16 +1,55 @@
-import strawberry
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from strawberry.extensions import QueryDepthLimiter, ValidationCache
 from strawberry.fastapi import GraphQLRouter
 
+from svrdb.counties import county_cache
+from svrdb.execution import PlainFieldsExecutionContext, Schema
+from svrdb.export import router as export_router
+from svrdb.httpcache import HttpCacheConfig, HttpCacheMiddleware
+from svrdb.metrics import GraphQLMetrics, render_metrics
+from svrdb.limits import QueryCostConfig, QueryCostLimiter
+from svrdb.persisted import PersistedQueryConfig, PersistedQueryMiddleware, QueryParserCache
+from svrdb.replicas import replicas
 from svrdb.types import Query
 
-schema = strawberry.Schema(Query)
+schema = Schema(Query, execution_context_class=PlainFieldsExecutionContext, extensions=[
+    GraphQLMetrics,
+    # the front end sends the same few queries over and over, so each is only parsed and validated once
+    QueryParserCache(maxsize=PersistedQueryConfig.SIZE),
+    QueryDepthLimiter(max_depth=QueryCostConfig.MAX_DEPTH),
+    ValidationCache(maxsize=PersistedQueryConfig.SIZE),
+    QueryCostLimiter,
+])
 
 graphql_app = GraphQLRouter(schema)
 
 app = FastAPI()
 app.include_router(graphql_app, prefix="/graphql")
+app.include_router(export_router, prefix="/export")
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    return render_metrics()
+
+
+@app.on_event("startup")
+def load_counties():
+    county_cache.reload()
+
+
+@app.on_event("startup")
+async def check_replicas():
+    replicas.start_checks()
+
+
+app.add_middleware(PersistedQueryMiddleware, path="/graphql")
+# outside the persisted queries, so that GET requests can send those too
+app.add_middleware(HttpCacheMiddleware, path="/graphql")
+app.add_middleware(GZipMiddleware, minimum_size=HttpCacheConfig.GZIP_MIN_SIZE)
 
 origins = ["*"]
 
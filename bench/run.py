@@ -0,0 +1,302 @@
+"""
+End-to-end benchmarks: generates a synthetic SPC dataset, seeds it through `seed.py` (timing every phase)
+and times GraphQL queries through the FastAPI app, then saves the timings as JSON.
+
+    python -m bench.run --scale small --out bench-small.json
+    python -m bench.run --scale small --compare bench-small.json
+
+Seeds into a SQLite file in the work directory unless `--database-url` is given, which must point at a scratch
+database: its tables are dropped.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+from bench import synthetic
+
+# years, tornadoes, hail and wind reports per year; `large` is about the size of the real dataset
+SCALES = {
+    'tiny': (range(2010, 2015), 50, 200, 200),
+    'small': (range(2000, 2020), 300, 1500, 2000),
+    'medium': (range(1980, 2020), 800, 4000, 5000),
+    'large': (range(1950, 2020), 1000, 6000, 8000),
+}
+
+# `seed.py` steps timed individually
+_SEED_PHASES = [
+    'seed_counties', 'seed_tornadoes', 'seed_hail', 'seed_wind', 'seed_parallel', 'build_rollups',
+    'bump_dataset_version', 'export_embedded',
+]
+
+_EVENT_FIELDS = 'id datetime state magnitude fatalities injuries loss'
+
+
+def _configure(workdir, database_url, response_cache):
+    # settings are read at import, so this has to run before anything from the app is imported
+    data_dir = os.path.join(workdir, 'data')
+    os.environ.update({
+        'RUN_REMOTE': 'true',
+        'DATA_FILE_DIR': data_dir,
+        'SEED_FRAME_CACHE_DIR': os.path.join(workdir, 'frame-cache'),
+        'DATABASE_URL': database_url or f'sqlite:///{os.path.join(workdir, "bench.sqlite")}',
+        'DB_ECHO': 'false',
+        **synthetic.FILES,
+    })
+    os.environ.setdefault('SEED_BLUE_GREEN', 'false')
+    if not response_cache:
+        # every run should hit the DB
+        os.environ['RESPONSE_CACHE_SIZE'] = '0'
+    return data_dir
+
+
+@contextmanager
+def _timed_steps(module, names, timings):
+    originals = {name: getattr(module, name) for name in names if hasattr(module, name)}
+
+    def timed(name, fn):
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                timings[name] = timings.get(name, 0) + time.perf_counter() - start
+        return wrapper
+
+    for name, fn in originals.items():
+        setattr(module, name, timed(name, fn))
+    try:
+        yield
+    finally:
+        for name, fn in originals.items():
+            setattr(module, name, fn)
+
+
+def _bench_seed(frame_cache_dir):
+    import seed
+
+    ret = {}
+    # cold: parses the CSVs, warm: reads the parsed frames back from the frame cache
+    for run in ('cold', 'warm'):
+        if run == 'cold':
+            shutil.rmtree(frame_cache_dir, ignore_errors=True)
+        timings = {}
+        with _timed_steps(seed, _SEED_PHASES, timings):
+            start = time.perf_counter()
+            seed.seed('all')
+            timings['total'] = time.perf_counter() - start
+        ret[run] = {name: round(seconds * 1000, 1) for name, seconds in timings.items()}
+    return ret
+
+
+class _Client:
+    """
+    Posts GraphQL queries straight into the ASGI app (through its middleware and routing), in process and
+    on one event loop, so timings leave out the network but not the server.
+    """
+
+    def __init__(self, app):
+        self._app = app
+        self._loop = asyncio.new_event_loop()
+        self._loop.run_until_complete(app.router.startup())
+
+    async def _post(self, path, body):
+        messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+        response = []
+
+        async def receive():
+            return messages.pop(0) if messages else {'type': 'http.disconnect'}
+
+        async def send(message):
+            if message['type'] == 'http.response.body':
+                response.append(message.get('body', b''))
+
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'POST', 'scheme': 'http',
+            'path': path, 'raw_path': path.encode(), 'root_path': '', 'query_string': b'',
+            'headers': [(b'host', b'bench'), (b'content-type', b'application/json')],
+            'client': ('127.0.0.1', 0), 'server': ('bench', 80),
+        }
+        await self._app(scope, receive, send)
+        return b''.join(response)
+
+    def post(self, query):
+        # the raw response body
+        return self._loop.run_until_complete(self._post('/graphql', json.dumps({'query': query}).encode()))
+
+    def close(self):
+        self._loop.run_until_complete(self._app.router.shutdown())
+        self._loop.close()
+
+
+def _query_cases(client):
+    def data(query):
+        response = json.loads(client.post(query))
+        if response.get('errors'):
+            raise ValueError(f'{query}: {response["errors"]}')
+        return response['data']
+
+    hail_count = data('{ hailStats { count } }')['hailStats'][0]['count']
+    deep = max(hail_count // 2, 1)
+    cursor = data(f'{{ hail(pagination: {{offset: {deep - 1}, limit: 1}}) {{ cursor }} }}')['hail'][0]['cursor']
+    county = synthetic.STATES[1][1] * 1000 + 1
+
+    return {
+        'flat_tornado': f'{{ tornado(filter: {{years: [2010]}}) {{ {_EVENT_FIELDS} length width }} }}',
+        'flat_hail': (
+            f'{{ hail(filter: {{years: [2010, 2011]}}, pagination: {{limit: 5000}}) {{ {_EVENT_FIELDS} }} }}'
+        ),
+        'nested_tornado': (
+            f'{{ tornado(filter: {{years: [2010, 2011]}}) {{ {_EVENT_FIELDS} segments {{ id state length '
+            f'counties {{ name state countyFips }} }} }} }}'
+        ),
+        'nested_wind_county': f'{{ wind(filter: {{years: [2010]}}) {{ {_EVENT_FIELDS} county {{ name }} }} }}',
+        'filter_states': f'{{ tornado(filter: {{states: ["KS", "OK"], months: [4, 5, 6]}}) {{ {_EVENT_FIELDS} }} }}',
+        'filter_county': f'{{ tornado(filter: {{countyFips: [{county}]}}) {{ {_EVENT_FIELDS} }} }}',
+        'filter_radius': (
+            f'{{ hail(filter: {{withinRadius: {{lat: 35.5, lon: -97.5, km: 100}}, sizeRange: [1.75, null]}}) '
+            f'{{ {_EVENT_FIELDS} }} }}'
+        ),
+        'filter_polygon_path': (
+            f'{{ tornado(filter: {{polygon: [[34, -100], [37, -100], [37, -96], [34, -96]]}}) '
+            f'{{ {_EVENT_FIELDS} }} }}'
+        ),
+        'filter_hours_days': f'{{ wind(filter: {{hours: [22, 23], days: [1, 15]}}) {{ {_EVENT_FIELDS} }} }}',
+        'page_deep_offset': f'{{ hail(pagination: {{offset: {deep}, limit: 500}}) {{ {_EVENT_FIELDS} cursor }} }}',
+        'page_deep_cursor': f'{{ hail(pagination: {{after: "{cursor}", limit: 500}}) {{ {_EVENT_FIELDS} cursor }} }}',
+        'stats_rollup': '{ hailStats(groupBy: [YEAR, STATE]) { year state count fatalities loss } }',
+        'stats_tornado_states': '{ tornadoStats(filter: {states: ["KS"]}, groupBy: [YEAR]) { year count length } }',
+        'stats_scan': (
+            '{ windStats(filter: {hours: [18, 19, 20]}, groupBy: [MONTH, MAGNITUDE]) { month magnitude count } }'
+        ),
+    }
+
+
+def _percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def _bench_queries(repeat):
+    import app
+
+    ret = {}
+    client = _Client(app.app)
+    try:
+        for name, query in _query_cases(client).items():
+            # the first run pays for parsing, validation and statement compilation
+            client.post(query)
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                response = client.post(query)
+                timings.append((time.perf_counter() - start) * 1000)
+            body = json.loads(response)
+            ret[name] = {
+                'median_ms': round(statistics.median(timings), 2),
+                'p95_ms': round(_percentile(timings, 95), 2),
+                'min_ms': round(min(timings), 2),
+                'mean_ms': round(statistics.mean(timings), 2),
+                'rows': sum(len(rows) for rows in (body.get('data') or {}).values()),
+                'bytes': len(response),
+                'error': body['errors'][0]['message'] if body.get('errors') else None,
+            }
+    finally:
+        client.close()
+    return ret
+
+
+def _git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _compare(results, baseline, threshold, min_delta_ms):
+    # prints every timing next to its baseline, and returns the ones that got slower by more than `threshold`
+    # (and by more than `min_delta_ms`, so jitter on millisecond timings doesn't count)
+    regressions = []
+    for section, key in (('seed', 'cold'), ('seed', 'warm'), ('queries', None)):
+        current, before = results[section], baseline.get(section, {})
+        if key is not None:
+            current, before = current.get(key, {}), before.get(key, {})
+        for name, value in current.items():
+            metric = 'median_ms' if section == 'queries' else None
+            new = value[metric] if metric else value
+            old = before.get(name, {}).get(metric) if metric else before.get(name)
+            if not old:
+                continue
+            label = f'{section}.{key}.{name}' if key else f'{section}.{name}'
+            print(f'{label:<40} {old:>10.1f} -> {new:>10.1f} ms  ({new / old:>5.2f}x)')
+            if new > old * threshold and new - old > min_delta_ms:
+                regressions.append(label)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scale', choices=SCALES, default='small')
+    parser.add_argument('--seed', type=int, default=0, help='random seed of the synthetic dataset')
+    parser.add_argument('--repeat', type=int, default=20, help='timed runs per query')
+    parser.add_argument('--workdir', help='where the dataset and SQLite DB go (a temporary directory by default)')
+    parser.add_argument('--database-url', help='scratch DB to seed instead of SQLite, its tables are dropped!')
+    parser.add_argument('--response-cache', action='store_true', help='time queries with the response cache on')
+    parser.add_argument('--out', help='write the results as JSON here')
+    parser.add_argument('--compare', help='earlier results to compare against, fails on regressions')
+    parser.add_argument('--threshold', type=float, default=1.25,
+                        help='slowdown vs. --compare counted as a regression (default 1.25x)')
+    parser.add_argument('--min-delta-ms', type=float, default=5,
+                        help='smallest slowdown vs. --compare counted as a regression (default 5ms)')
+    args = parser.parse_args(argv)
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='svrdb-bench-')
+    data_dir = _configure(workdir, args.database_url, args.response_cache)
+    try:
+        years, tornadoes, hail, wind = SCALES[args.scale]
+        start = time.perf_counter()
+        synthetic.generate(data_dir, years, tornadoes, hail, wind, seed=args.seed)
+        generate_ms = round((time.perf_counter() - start) * 1000, 1)
+
+        results = {
+            'meta': {
+                'scale': args.scale, 'seed': args.seed, 'repeat': args.repeat,
+                'response_cache': args.response_cache,
+                'database': os.environ['DATABASE_URL'].split(':', 1)[0],
+                'revision': _git_revision(), 'python': platform.python_version(), 'platform': platform.platform(),
+                'date': datetime.now().isoformat(timespec='seconds'),
+            },
+            'generate_ms': generate_ms,
+            'seed': _bench_seed(os.environ['SEED_FRAME_CACHE_DIR']),
+            'queries': _bench_queries(args.repeat),
+        }
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    print(json.dumps(results, indent=2))
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = _compare(results, json.load(f), args.threshold, args.min_delta_ms)
+        if regressions:
+            print(f'Slower by more than {args.threshold}x: {", ".join(regressions)}')
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
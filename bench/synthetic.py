@@ -0,0 +1,164 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+# abbreviation, FIPS, rough center lat/lon; tornadoes crossing a state line continue into the next one
+STATES = [
+    ('TX', 48, 31.5, -99.0), ('OK', 40, 35.5, -97.5), ('KS', 20, 38.5, -98.5), ('NE', 31, 41.5, -99.5),
+    ('IA', 19, 42.0, -93.5), ('MO', 29, 38.5, -92.5), ('IL', 17, 40.0, -89.0), ('AR', 5, 34.9, -92.4),
+    ('MS', 28, 32.7, -89.7), ('AL', 1, 32.8, -86.8),
+]
+COUNTIES_PER_STATE = 75
+
+FILES = {
+    'SPC_TOR_FILE': 'synthetic_tornadoes.csv',
+    'SPC_HAIL_FILE': 'synthetic_hail.csv',
+    'SPC_WIND_FILE': 'synthetic_wind.csv',
+    'US_COUNTY_FILE': 'synthetic_cty_fips.txt',
+}
+
+_COLUMNS = [
+    'om', 'yr', 'mo', 'dy', 'date', 'time', 'tz', 'st', 'stf', 'stn', 'mag', 'inj', 'fat', 'loss', 'closs',
+    'slat', 'slon', 'elat', 'elon', 'len', 'wid', 'ns', 'sn', 'sg', 'f1', 'f2', 'f3', 'f4',
+]
+
+# share of tornadoes crossing into another state (a full track plus a segment per state),
+# and of single state ones listing more than 4 counties (a county continuation record)
+MULTI_STATE_SHARE = 0.05
+CONTINUATION_SHARE = 0.01
+
+
+def _county_fips(rng, n, unknown_share=0.0):
+    # counties are numbered with odd FIPS codes like most states do, 0 is unknown
+    fips = rng.integers(0, COUNTIES_PER_STATE, n) * 2 + 1
+    return np.where(rng.random(n) < unknown_share, 0, fips)
+
+
+def _events(rng, years, per_year):
+    n = len(years) * per_year
+    state = rng.integers(0, len(STATES), n)
+    _, state_fips, center_lat, center_lon = (np.array(col) for col in zip(*STATES))
+    ret = pd.DataFrame({
+        'yr': np.repeat(years, per_year),
+        'om': np.tile(np.arange(1, per_year + 1), len(years)),
+        # spring heavy, like the real thing
+        'mo': rng.choice(np.arange(1, 13), n, p=np.array([2, 3, 8, 14, 18, 16, 10, 7, 6, 6, 5, 5]) / 100),
+        'dy': rng.integers(1, 29, n),
+        'hr': rng.integers(0, 24, n),
+        'mn': rng.integers(0, 60, n),
+        'tz': 3,
+        'state': state,
+        'stf': state_fips[state],
+        'stn': 0,
+        'inj': rng.poisson(0.3, n),
+        'fat': rng.poisson(0.02, n),
+        'loss': rng.exponential(0.05, n).round(4),
+        'closs': 0,
+        'slat': (center_lat[state] + rng.uniform(-1.5, 1.5, n)).round(2),
+        'slon': (center_lon[state] + rng.uniform(-2.5, 2.5, n)).round(2),
+    })
+    ret['st'] = np.array([st for st, *_ in STATES])[state]
+    return ret
+
+
+def _format(df):
+    df['date'] = [f'{yr}-{mo:02d}-{dy:02d}' for yr, mo, dy in zip(df['yr'], df['mo'], df['dy'])]
+    df['time'] = [f'{hr:02d}:{mn:02d}:00' for hr, mn in zip(df['hr'], df['mn'])]
+    return df
+
+
+def _tornadoes(rng, years, per_year):
+    df = _events(rng, years, per_year)
+    if 1966 not in years:
+        # the SPC corrections patch tornadoes 13 and 14 of 1966 and expect them to exist, as one record each
+        df = pd.concat([_events(rng, [1966], 14), df], ignore_index=True)
+    patched = (df['yr'] == 1966) & df['om'].isin([13, 14])
+    n = len(df)
+    df['mag'] = rng.choice([0, 1, 2, 3, 4, 5], n, p=[0.45, 0.33, 0.15, 0.05, 0.015, 0.005])
+    # mostly southwest to northeast tracks
+    length = rng.lognormal(0.7, 1.1, n).clip(0.1, 200).round(2)
+    bearing = np.radians(rng.normal(60, 20, n))
+    df['len'] = length
+    df['elat'] = (df['slat'] + length * np.cos(bearing) / 69).round(2)
+    df['elon'] = (df['slon'] + length * np.sin(bearing) / 55).round(2)
+    df['wid'] = rng.lognormal(4.5, 1.0, n).clip(10, 4000).astype(int)
+    df['ns'], df['sn'], df['sg'] = 1, 1, 1
+    df['f1'] = _county_fips(rng, n, unknown_share=0.02)
+    df['f2'] = np.where(rng.random(n) < 0.3, _county_fips(rng, n), 0)
+    df['f3'], df['f4'] = 0, 0
+    # full tracks, then their segments, then continuation records
+    df['order'] = 1
+
+    multi = ~patched & (rng.random(n) < MULTI_STATE_SHARE)
+    continued = ~patched & ~multi & (rng.random(n) < CONTINUATION_SHARE)
+
+    # a full track plus one segment per state, each covering half the path
+    track = df[multi].copy()
+    track['ns'], track['sn'] = 2, 0
+    track['order'] = 0
+    first = df[multi].copy()
+    first['ns'], first['sg'] = 2, 2
+    first['elat'] = ((first['slat'] + first['elat']) / 2).round(2)
+    first['elon'] = ((first['slon'] + first['elon']) / 2).round(2)
+    first['len'] = (first['len'] / 2).round(2)
+    second = first.copy()
+    second['slat'], second['slon'] = first['elat'], first['elon']
+    second['elat'], second['elon'] = track['elat'], track['elon']
+    second['state'] = (second['state'] + 1) % len(STATES)
+    second['st'] = np.array([st for st, *_ in STATES])[second['state']]
+    second['stf'] = np.array([fips for _, fips, *_ in STATES])[second['state']]
+    second['f1'] = _county_fips(rng, len(second))
+    second['f2'] = 0
+    second['mn'] = (second['mn'] + 5).clip(upper=59)
+
+    # counties past the 4th go in a record of their own
+    for col in ('f2', 'f3', 'f4'):
+        df.loc[continued, col] = _county_fips(rng, continued.sum())
+    continuation = df[continued].copy()
+    continuation['sn'], continuation['sg'] = 0, -9
+    continuation['f1'] = _county_fips(rng, len(continuation))
+    continuation['f2'] = _county_fips(rng, len(continuation))
+    continuation['mn'] = (continuation['mn'] + 1).clip(upper=59)
+    continuation['order'] = 2
+
+    df = pd.concat([df[~multi], track, first, second, continuation])
+    df['fc'] = 0
+    # in SPC order
+    df = df.sort_values(['yr', 'om', 'order'], kind='mergesort')
+    return _format(df)[_COLUMNS + ['fc']]
+
+
+def _points(rng, years, per_year, magnitudes):
+    df = _events(rng, years, per_year)
+    n = len(df)
+    df['mag'] = rng.choice(magnitudes, n)
+    df['elat'], df['elon'], df['len'], df['wid'] = 0, 0, 0, 0
+    df['ns'], df['sn'], df['sg'] = 1, 1, 1
+    df['f1'] = _county_fips(rng, n, unknown_share=0.05)
+    df['f2'], df['f3'], df['f4'] = 0, 0, 0
+    return _format(df)[_COLUMNS]
+
+
+def generate(directory, years, tornadoes_per_year, hail_per_year, wind_per_year, seed=0):
+    """
+    Writes a reproducible SPC-like tornado, hail and wind CSV, and the county file they reference, to
+    `directory`. Returns the file names by the env variable seeding reads them from.
+    """
+    rng = np.random.default_rng(seed)
+    years = np.asarray(years)
+    os.makedirs(directory, exist_ok=True)
+
+    counties = pd.DataFrame([
+        (st, state_fips, fips, f'County {fips} {st}')
+        for st, state_fips, *_ in STATES for fips in range(1, COUNTIES_PER_STATE * 2, 2)
+    ])
+    counties.to_csv(os.path.join(directory, FILES['US_COUNTY_FILE']), header=False, index=False)
+
+    _tornadoes(rng, years, tornadoes_per_year).to_csv(os.path.join(directory, FILES['SPC_TOR_FILE']), index=False)
+    hail_sizes = [0.75, 0.88, 1.0, 1.25, 1.5, 1.75, 2.0, 2.5, 2.75, 3.0, 4.0, 4.5]
+    _points(rng, years, hail_per_year, hail_sizes).to_csv(os.path.join(directory, FILES['SPC_HAIL_FILE']),
+                                                           index=False)
+    _points(rng, years, wind_per_year, np.arange(50, 95, 5)).to_csv(os.path.join(directory, FILES['SPC_WIND_FILE']),
+                                                                    index=False)
+    return dict(FILES)
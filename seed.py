@@ -1,29 +1,64 @@
 from decouple import config
 
-from seeding.counties import seed_counties
+from seeding.bluegreen import (
+    supports_swap, create_shadow_tables, get_shadow_session, check_shadow_tables, swap_shadow_tables
+)
+from seeding.counties import seed_counties, load_county_ref
+from seeding.embedded import EmbeddedConfig, export_embedded
+from seeding.parallel import supports_parallel, seed_parallel
+from seeding.rollups import build_rollups
 from seeding.spc import seed_tornadoes, seed_hail, seed_wind
-from svrdb.models import get_session, Base, engine
+from svrdb.counties import county_cache
+from svrdb.dataset import bump_dataset_version
+from svrdb.models import get_session, Base, engine, County, Tornado, TornadoSegment, Hail, Wind
 
 
-def seed(to_seed, recreate_tables=True):
+def seed(to_seed, recreate_tables=True, incremental=False):
     if to_seed not in ('tornado', 'all'):
         print(f'SEED_DB argument: {to_seed} not `tornado` or `all`, skip seeding')
         return
 
-    if recreate_tables:
+    # a full reseed loads into shadow tables that are swapped in once complete, so the API never serves
+    # half-loaded tables
+    blue_green = recreate_tables and not incremental and supports_swap()
+
+    if incremental:
+        # reload only the years that changed since the last seed, in place and with the API up
+        Base.metadata.create_all(engine)
+    elif blue_green:
+        create_shadow_tables()
+    elif recreate_tables:
         Base.metadata.drop_all(engine)
         Base.metadata.create_all(engine)
 
-    with get_session() as session:
-        county_ref = seed_counties(session)
-        seed_tornadoes(session, county_ref)
+    with get_shadow_session() if blue_green else get_session() as session:
+        county_ref = load_county_ref(session) if incremental else None
+        if county_ref is None or county_ref.empty:
+            county_ref = seed_counties(session)
+
+        if supports_parallel() and not incremental:
+            seed_parallel(session, to_seed, county_ref, shadow=blue_green)
+        else:
+            seed_tornadoes(session, county_ref, incremental)
 
-        if to_seed == 'all':
-            seed_hail(session, county_ref)
-            seed_wind(session, county_ref)
+            if to_seed == 'all':
+                seed_hail(session, county_ref, incremental)
+                seed_wind(session, county_ref, incremental)
 
+        seeded = [Tornado] + ([Hail, Wind] if to_seed == 'all' else [])
+        build_rollups(session, seeded)
+        bump_dataset_version(session)
         session.commit()
 
+    if blue_green:
+        check_shadow_tables([County, TornadoSegment] + seeded)
+        swap_shadow_tables()
+
+    if EmbeddedConfig.FILE:
+        export_embedded(EmbeddedConfig.FILE)
+
+    county_cache.reload()
+
 
 if __name__ == '__main__':
-    seed(config('SEED_DB', default='none'))
+    seed(config('SEED_DB', default='none'), incremental=config('SEED_INCREMENTAL', default=False, cast=bool))
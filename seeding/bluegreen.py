@@ -0,0 +1,79 @@
+from decouple import config
+from sqlalchemy import func, inspect, select
+from sqlalchemy.orm import Session
+
+from svrdb.models import Base, Tornado, TornadoSegment, engine
+
+
+class BlueGreenConfig:
+    ENABLED = config('SEED_BLUE_GREEN', default=True, cast=bool)
+    # another database on the same MySQL server, which tables can be renamed in and out of
+    SHADOW_SCHEMA = config('SEED_SHADOW_SCHEMA', default=f'{engine.url.database}_shadow')
+    # refuse to swap in a table that lost more than this share of the live table's rows
+    MIN_ROW_RATIO = config('SEED_MIN_ROW_RATIO', default=0.9, cast=float)
+
+
+# the same tables, compiled against the shadow schema
+shadow_engine = engine.execution_options(schema_translate_map={None: BlueGreenConfig.SHADOW_SCHEMA})
+
+
+def supports_swap():
+    # RENAME TABLE across schemas is MySQL only, other DBs are (re)seeded in place
+    return BlueGreenConfig.ENABLED and engine.dialect.name == 'mysql'
+
+
+def create_shadow_tables():
+    with engine.begin() as conn:
+        conn.exec_driver_sql(f'CREATE DATABASE IF NOT EXISTS `{BlueGreenConfig.SHADOW_SCHEMA}`')
+    # whatever is left from the last swap (the previous live tables) goes
+    Base.metadata.drop_all(shadow_engine)
+    Base.metadata.create_all(shadow_engine)
+
+
+def get_shadow_session():
+    return Session(bind=shadow_engine, future=True)
+
+
+def _row_counts(bind, tables):
+    with bind.connect() as conn:
+        return {table.name: conn.execute(select(func.count()).select_from(table)).scalar() for table in tables}
+
+
+def check_shadow_tables(seeded_models):
+    tables = [model.__table__ for model in seeded_models]
+    shadow_counts = _row_counts(shadow_engine, tables)
+    live_tables = set(inspect(engine).get_table_names())
+    live_counts = _row_counts(engine, [table for table in tables if table.name in live_tables])
+
+    for name, count in shadow_counts.items():
+        if count == 0 or count < live_counts.get(name, 0) * BlueGreenConfig.MIN_ROW_RATIO:
+            raise ValueError(f'Shadow table {name} has {count} rows vs {live_counts.get(name, 0)} live, '
+                             f'not swapping! Re-evaluate the data')
+
+    if Tornado in seeded_models:
+        with shadow_engine.connect() as conn:
+            without_segments = conn.execute(
+                select(func.count()).select_from(Tornado).where(
+                    ~Tornado.id.in_(select(TornadoSegment.tornado_id))
+                )
+            ).scalar()
+        if without_segments:
+            raise ValueError(f'{without_segments} tornadoes without segments, not swapping! Re-evaluate the data')
+
+
+def swap_shadow_tables():
+    # a single RENAME TABLE is atomic, readers see either every old table or every new one
+    live, shadow = engine.url.database, BlueGreenConfig.SHADOW_SCHEMA
+    live_tables = set(inspect(engine).get_table_names())
+
+    renames = []
+    for table in Base.metadata.sorted_tables:
+        if table.name in live_tables:
+            renames.append(f'`{live}`.`{table.name}` TO `{shadow}`.`{table.name}_old`')
+        renames.append(f'`{shadow}`.`{table.name}` TO `{live}`.`{table.name}`')
+        if table.name in live_tables:
+            # the previous data stays around in the shadow schema until the next seed
+            renames.append(f'`{shadow}`.`{table.name}_old` TO `{shadow}`.`{table.name}`')
+
+    with engine.begin() as conn:
+        conn.exec_driver_sql('RENAME TABLE ' + ', '.join(renames))
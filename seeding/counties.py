@@ -1,18 +1,23 @@
 import pandas as pd
+from sqlalchemy import select
 
 from svrdb.models import County
 from seeding.datasrcs import files
+from seeding.load import insert_frame
 
 
 def seed_counties(session):
     county_df = pd.read_csv(files.US_COUNTIES,
                             names=['state', 'state_fips', 'county_fips', 'county'],
                             index_col=False)
-
-    records = county_df.to_dict(orient='records')
-    db_counties = [County(id=i, **rec) for i, rec in enumerate(records, start=1)]
-    session.bulk_save_objects(db_counties)
+    county_df['id'] = range(1, len(county_df) + 1)
+    insert_frame(session, County, county_df)
 
     # return the df for in-memory lookup on county id's
-    county_df['county_id'] = [cty.id for cty in db_counties]
-    return county_df
+    return county_df.rename(columns={'id': 'county_id'})
+
+
+def load_county_ref(session):
+    # the same lookup as `seed_counties` returns, from counties already in the DB
+    rows = session.execute(select(County.state, County.state_fips, County.county_fips, County.county, County.id))
+    return pd.DataFrame(rows.all(), columns=['state', 'state_fips', 'county_fips', 'county', 'county_id'])
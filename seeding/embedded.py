@@ -0,0 +1,46 @@
+import os
+
+from decouple import config
+from sqlalchemy import create_engine, event, insert, select
+
+from seeding.load import LoadConfig
+from svrdb.models import Base, engine
+
+
+class EmbeddedConfig:
+    # where to write a read-only SQLite copy of the seeded DB, for serving with DB_EMBEDDED_FILE
+    FILE = config('SEED_EMBEDDED_FILE', default=None)
+
+
+def _build_pragmas(dbapi_connection, _connection_record):
+    # nothing to recover from, the file is only moved into place once complete
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode=OFF')
+    cursor.execute('PRAGMA synchronous=OFF')
+    cursor.close()
+
+
+def export_embedded(path):
+    tmp_path = f'{path}.tmp'
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    target = create_engine(f'sqlite:///{tmp_path}', future=True)
+    event.listen(target, 'connect', _build_pragmas)
+    # the same schema and indexes
+    Base.metadata.create_all(target)
+
+    with engine.connect() as src, target.begin() as dst:
+        for table in Base.metadata.sorted_tables:
+            result = src.execution_options(stream_results=True).execute(select(table))
+            for rows in result.partitions(LoadConfig.BATCH_SIZE):
+                dst.execute(insert(table), [dict(row._mapping) for row in rows])
+
+    with target.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        # planner statistics, then compact the file
+        conn.exec_driver_sql('ANALYZE')
+        conn.exec_driver_sql('VACUUM')
+    target.dispose()
+
+    # processes serving the previous file keep reading it until they reconnect
+    os.replace(tmp_path, path)
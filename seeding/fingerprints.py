@@ -0,0 +1,55 @@
+from collections import defaultdict
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import delete, insert, select
+
+from svrdb.models import SeedFingerprint
+
+# ids are assigned positionally, so they shift whenever an earlier record changes and can't be part of a fingerprint
+_ID_COLUMNS = ('id', 'tornado_id', 'tornado_segment_id')
+
+
+class YearFingerprints:
+    # the (wrapping) sum of a year's row hashes, so fingerprints don't depend on row order and
+    # partial fingerprints from separate chunks or processes can be merged
+    def __init__(self):
+        self._sums = defaultdict(int)
+        self._counts = defaultdict(int)
+
+    def update(self, df, years):
+        hashes = pd.util.hash_pandas_object(df.drop(columns=list(_ID_COLUMNS), errors='ignore'), index=False)
+        for year, year_hashes in hashes.groupby(years.to_numpy()):
+            self._add(int(year), int(year_hashes.to_numpy().sum(dtype=np.uint64)), len(year_hashes))
+
+    def merge(self, other):
+        for year, count in other._counts.items():
+            self._add(year, other._sums[year], count)
+
+    def _add(self, year, total, count):
+        self._sums[year] = (self._sums[year] + total) % 2 ** 64
+        self._counts[year] += count
+
+    def hexdigests(self):
+        return {year: f'{count}-{self._sums[year]:016x}' for year, count in self._counts.items()}
+
+
+def stored_fingerprints(session, dataset):
+    rows = session.execute(
+        select(SeedFingerprint.year, SeedFingerprint.fingerprint).where(SeedFingerprint.dataset == dataset)
+    )
+    return dict(rows.all())
+
+
+def store_fingerprints(session, dataset, fingerprints):
+    table = SeedFingerprint.__table__
+    session.execute(delete(table).where(table.c.dataset == dataset))
+    if fingerprints:
+        session.execute(insert(table), [
+            dict(dataset=dataset, year=year, fingerprint=fingerprint) for year, fingerprint in fingerprints.items()
+        ])
+
+
+def changed_years(stored, current):
+    # new, changed, and removed years all get reloaded
+    return {year for year in stored.keys() | current.keys() if stored.get(year) != current.get(year)}
@@ -0,0 +1,50 @@
+import glob
+import hashlib
+import inspect
+import os
+
+from decouple import config
+
+from seeding.datasrcs import get_datadir
+
+
+class FrameCacheConfig:
+    ENABLED = config('SEED_FRAME_CACHE', default=True, cast=bool)
+    DIR = config('SEED_FRAME_CACHE_DIR', default=os.path.join(get_datadir(), '.frame-cache'))
+
+
+def _cache_key(source, code):
+    digest = hashlib.sha256()
+    with open(source, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    for obj in code:
+        digest.update(inspect.getsource(obj).encode())
+    return digest.hexdigest()[:16]
+
+
+def cached_table(source, parse, *depends_on):
+    """
+    The frame `parse(source)` returns, as an Arrow table memory-mapped from the cache, which is rebuilt
+    whenever the source file or the code of `parse` and `depends_on` (functions or modules) changes.
+    None if caching is disabled or pyarrow isn't installed.
+    """
+    if not FrameCacheConfig.ENABLED:
+        return None
+    try:
+        from pyarrow import feather
+    except ImportError:
+        return None
+
+    name = os.path.basename(source)
+    path = os.path.join(FrameCacheConfig.DIR, f'{name}-{_cache_key(source, (parse, *depends_on))}.arrow')
+    if not os.path.exists(path):
+        os.makedirs(FrameCacheConfig.DIR, exist_ok=True)
+        for stale in glob.glob(os.path.join(FrameCacheConfig.DIR, f'{glob.escape(name)}-*.arrow')):
+            os.remove(stale)
+        # uncompressed, so it can be memory-mapped; written aside first so readers never see a partial file
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        feather.write_feather(parse(source).reset_index(drop=True), tmp_path, compression='uncompressed')
+        os.replace(tmp_path, path)
+
+    return feather.read_table(path, memory_map=True)
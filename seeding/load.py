@@ -0,0 +1,23 @@
+import pandas as pd
+from decouple import config
+from sqlalchemy import insert
+
+
+class LoadConfig:
+    # rows per INSERT batch (and per chunk read from the point report files)
+    BATCH_SIZE = config('SEED_BATCH_SIZE', default=10000, cast=int)
+
+
+def _records(df):
+    values = df.astype(object)
+    for col in df.columns[df.dtypes.map(lambda dtype: dtype.kind == 'M')]:
+        # plain datetimes, not pandas Timestamps, for the DB driver
+        values[col] = pd.Series(df[col].dt.to_pydatetime(), index=df.index, dtype=object)
+    return values.where(df.notna(), None).to_dict(orient='records')
+
+
+def insert_frame(session, model, df):
+    # chunked executemany through Core, without building an ORM object per row
+    stmt = insert(model.__table__)
+    for start in range(0, len(df), LoadConfig.BATCH_SIZE):
+        session.execute(stmt, _records(df.iloc[start:start + LoadConfig.BATCH_SIZE]))
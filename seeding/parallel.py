@@ -0,0 +1,116 @@
+import math
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import pandas as pd
+from decouple import config
+
+from seeding.bluegreen import get_shadow_session
+from seeding.datasrcs import files
+from seeding.fingerprints import YearFingerprints, store_fingerprints
+from seeding.load import insert_frame
+from seeding.spc import (
+    read_tornadoes, tornado_masks, tornado_frames, tornado_fingerprints, point_table, point_frames
+)
+from svrdb.models import (
+    Tornado, TornadoSegment, TornadoSegmentCounty, TornadoLocation, Hail, Wind, engine, get_session
+)
+
+
+class ParallelConfig:
+    # 1 seeds everything in the parent process, one dataset after another
+    WORKERS = config('SEED_WORKERS', default=1, cast=int)
+
+
+def supports_parallel():
+    # concurrent writers just end up waiting on each other's locks on sqlite
+    return ParallelConfig.WORKERS > 1 and engine.dialect.name != 'sqlite'
+
+
+def _get_session(shadow):
+    return get_shadow_session() if shadow else get_session()
+
+
+def _seed_tornado_partition(df, county_ref, first_ids, shadow):
+    frames = tornado_frames(df, county_ref, first_ids)
+    with _get_session(shadow) as session:
+        for model, frame in frames.items():
+            insert_frame(session, model, frame)
+        session.commit()
+    return tornado_fingerprints(frames)
+
+
+def _seed_point_partition(model, file, county_ref, start, rows, shadow):
+    fingerprints = YearFingerprints()
+    next_id = start + 1
+    with _get_session(shadow) as session:
+        for df in point_frames(county_ref, file, start, rows):
+            fingerprints.update(df, df['year'])
+            df['id'] = range(next_id, next_id + len(df))
+            next_id += len(df)
+            insert_frame(session, model, df)
+        session.commit()
+    return fingerprints
+
+
+def _first_ids(counts):
+    # where each partition's ids start, given how many rows (at most) every partition needs
+    return (counts.cumsum() - counts + 1).astype(int)
+
+
+def _submit_tornadoes(pool, county_ref, shadow):
+    # corrections can span years, so the file is read and corrected whole, then transformed and written by year
+    # (segments and continuation records are always matched within a year)
+    df = read_tornadoes()
+    is_tornado, is_segment, is_continuation = tornado_masks(df)
+    by_year = pd.DataFrame({
+        Tornado: is_tornado, TornadoSegment: is_segment,
+        # up to 4 counties per segment and continuation record
+        TornadoSegmentCounty: (is_segment | is_continuation) * 4,
+        # plus a state per segment
+        TornadoLocation: (is_segment | is_continuation) * 4 + is_segment,
+    }).groupby(df['yr']).sum()
+    first_ids = by_year.apply(_first_ids)
+
+    return [
+        pool.submit(_seed_tornado_partition, year_df, county_ref, first_ids.loc[year].to_dict(), shadow)
+        for year, year_df in df.groupby('yr')
+    ]
+
+
+def _count_records(file):
+    with open(file, 'rb') as f:
+        lines = sum(block.count(b'\n') for block in iter(lambda: f.read(1 << 20), b''))
+    # minus the header
+    return lines - 1
+
+
+def _submit_points(pool, model, file, county_ref, shadow):
+    # the file is split into one range of records per worker, each numbered from its position in the file
+    # (building the parsed frame cache here, before the workers would all race to)
+    table = point_table(file)
+    records = _count_records(file) if table is None else table.num_rows
+    rows = math.ceil(records / ParallelConfig.WORKERS)
+    return [
+        pool.submit(_seed_point_partition, model, file, county_ref, start, rows, shadow)
+        for start in range(0, records, rows)
+    ]
+
+
+def seed_parallel(session, to_seed, county_ref, shadow=False):
+    # the workers write through their own connections, so they need to see the counties
+    session.commit()
+
+    with ProcessPoolExecutor(max_workers=ParallelConfig.WORKERS, mp_context=get_context('spawn')) as pool:
+        futures = {Tornado: _submit_tornadoes(pool, county_ref, shadow)}
+        if to_seed == 'all':
+            futures[Hail] = _submit_points(pool, Hail, files.SPC_HAIL, county_ref, shadow)
+            futures[Wind] = _submit_points(pool, Wind, files.SPC_WIND, county_ref, shadow)
+
+        fingerprints = {model: YearFingerprints() for model in futures}
+        for model, model_futures in futures.items():
+            for future in model_futures:
+                fingerprints[model].merge(future.result())
+
+    for model, model_fingerprints in fingerprints.items():
+        store_fingerprints(session, model.__tablename__, model_fingerprints.hexdigests())
@@ -0,0 +1,29 @@
+from sqlalchemy import delete, func, insert, select
+
+from svrdb.models import Tornado, Hail, Wind, TornadoRollup, HailRollup, WindRollup
+
+_ROLLUPS = {
+    Tornado: TornadoRollup,
+    Hail: HailRollup,
+    Wind: WindRollup,
+}
+
+
+def build_rollups(session, models):
+    # rebuilt from the event tables as they now stand, in the seed's own transaction
+    for model in models:
+        rollup = _ROLLUPS[model]
+        dimensions = [model.year, model.month, model.state, model.magnitude]
+        totals = [
+            func.count().label('count'),
+            func.coalesce(func.sum(model.fatalities), 0).label('fatalities'),
+            func.coalesce(func.sum(model.injuries), 0).label('injuries'),
+            func.coalesce(func.sum(model.loss), 0).label('loss'),
+            func.coalesce(func.sum(model.closs), 0).label('closs'),
+        ]
+        if model is Tornado:
+            totals.append(func.coalesce(func.sum(model.length), 0).label('length'))
+
+        stmt = select(*dimensions, *totals).group_by(*dimensions)
+        session.execute(delete(rollup.__table__))
+        session.execute(insert(rollup.__table__).from_select([col.name for col in stmt.selected_columns], stmt))
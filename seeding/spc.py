@@ -1,153 +1,336 @@
 import numpy as np
 import pandas as pd
+from sqlalchemy import delete, func, select
 
+from seeding import spc_corrections
 from seeding.datasrcs import files
-from seeding.spc_corrections import correct_tor_records
+from seeding.framecache import cached_table
+from seeding.fingerprints import YearFingerprints, changed_years, stored_fingerprints, store_fingerprints
+from seeding.load import LoadConfig, insert_frame
+from svrdb.geo import CELL_SIZE, grid_cell
 from svrdb.models import (
     Hail, Wind, Tornado,
-    TornadoSegment, TornadoSegmentCounty
+    TornadoSegment, TornadoSegmentCounty, TornadoGridCell, TornadoLocation
 )
 
-
-def seed_tornadoes(session, county_ref):
-    df = pd.read_csv(files.SPC_TOR, parse_dates=[['date', 'time']], index_col=False)
-    df = correct_tor_records(df)
-
-    dts = pd.to_timedelta(df['tz'].apply(lambda tz: 0 if tz == 9 else 6), unit='H')
-    converted = df['date_time'] + dts
-    df['datetime'] = converted
-
-    def find_counties(targ_df):
-        counties = []
-        for county_col in ('f1', 'f2', 'f3', 'f4'):
-            merged = targ_df[['stf', county_col]].merge(
-                county_ref,
-                left_on=['stf', county_col],
-                right_on=['state_fips', 'county_fips'],
-                how='left'
-            )
-            counties.append(merged['county_id'])
-
-        county_map = pd.concat(counties, axis=1).replace({np.nan, None})
-        county_map.columns = [f'county_id_{i}' for i in range(1, 5)]
-        return county_map
-
-    df = pd.concat([df, find_counties(df)], axis=1)
-
+# stored and indexed on every event so temporal filters don't have to wrap `datetime` in a function
+_DATETIME_PARTS = ('year', 'month', 'day', 'hour')
+_COUNTY_COLUMNS = ('f1', 'f2', 'f3', 'f4')
+
+# DB column -> SPC column
+_EVENT_COLUMNS = {
+    'state': 'st',
+    'magnitude': 'mag',
+    'fatalities': 'fat',
+    'injuries': 'inj',
+    'datetime': 'datetime',
+    **{part: part for part in _DATETIME_PARTS},
+    'loss': 'loss',
+    'closs': 'closs',
+}
+
+_TORNADO_COLUMNS = {
+    **_EVENT_COLUMNS,
+    'start_lat': 'slat',
+    'start_lon': 'slon',
+    'end_lat': 'elat',
+    'end_lon': 'elon',
+    'length': 'len',
+    'width': 'wid',
+    'magnitude_unk': 'fc',
+    'id': 'id',
+}
+
+_POINT_COLUMNS = {
+    **_EVENT_COLUMNS,
+    'lat': 'slat',
+    'lon': 'slon',
+    'grid_cell': 'grid_cell',
+    'county_id': 'county_id',
+}
+
+
+def _read_spc(file, **kwargs):
+    return pd.read_csv(file, parse_dates=[['date', 'time']], index_col=False, **kwargs)
+
+
+def _add_datetime(df):
+    # everything is converted to UTC, records are CST (tz=3) unless they are already in GMT (tz=9)
+    df['datetime'] = df['date_time'] + pd.to_timedelta(np.where(df['tz'] == 9, 0, 6), unit='H')
+    for part in _DATETIME_PARTS:
+        df[part] = getattr(df['datetime'].dt, part)
+
+
+def _to_table(df, columns):
+    ret = df[list(columns.values())].copy()
+    ret.columns = list(columns.keys())
+    return ret
+
+
+def _path_grid_cells(path_df):
+    # rasterize every path into the grid cells it passes through, sampling it every half cell
+    start_lat, start_lon, end_lat, end_lon = (
+        path_df[col].astype(float).round(4).to_numpy() for col in ('slat', 'slon', 'elat', 'elon')
+    )
+    delta_lat, delta_lon = end_lat - start_lat, end_lon - start_lon
+    steps = np.ceil(np.maximum(np.abs(delta_lat), np.abs(delta_lon)) / (CELL_SIZE / 2)).astype(int) + 1
+
+    path_idx = np.repeat(np.arange(len(path_df)), steps)
+    step_idx = np.arange(len(path_idx)) - np.repeat(np.cumsum(steps) - steps, steps)
+    frac = step_idx / np.maximum(steps - 1, 1)[path_idx]
+
+    cells = grid_cell(start_lat[path_idx] + delta_lat[path_idx] * frac,
+                      start_lon[path_idx] + delta_lon[path_idx] * frac)
+    return pd.DataFrame({
+        'cell': cells.astype(int),
+        'tornado_id': path_df['tornado_id'].astype(int).to_numpy()[path_idx]
+    }).drop_duplicates()
+
+
+def _segment_counties(seg_df, continuation_df, county_ref, first_id=1):
+    # a segment's own counties come first, then those of its continuation records in time order
+    sources = pd.concat([seg_df, continuation_df.sort_values(by='datetime', kind='mergesort')], ignore_index=True)
+    county_df = sources[['id', 'stf', *_COUNTY_COLUMNS]].reset_index().melt(
+        id_vars=['index', 'id', 'stf'], value_vars=_COUNTY_COLUMNS, var_name='county_col', value_name='fips'
+    )
+    # unknown (0) or unmatched fips drop out of the inner join
+    county_df = county_df.merge(
+        county_ref[['state_fips', 'county_fips', 'county_id']],
+        left_on=['stf', 'fips'],
+        right_on=['state_fips', 'county_fips']
+    ).sort_values(by=['index', 'county_col'], kind='mergesort')
+
+    ret = pd.DataFrame({
+        'tornado_segment_id': county_df['id'],
+        'county_id': county_df['county_id'],
+        'county_order': county_df.groupby('id').cumcount() + 1
+    })
+    ret['id'] = range(first_id, first_id + len(ret))
+    return ret
+
+
+def _tornado_locations(tor_df, seg_df, segment_county_df, county_ref, first_id=1):
+    # one row per state and per county any of a tornado's segments touches
+    segment_tornadoes = pd.Series(seg_df['tornado_id'].to_numpy(), index=seg_df['id'].to_numpy())
+    county_states = pd.Series(county_ref['state'].to_numpy(), index=county_ref['county_id'].to_numpy())
+
+    ret = pd.concat([
+        pd.DataFrame({
+            'tornado_id': seg_df['tornado_id'].to_numpy(),
+            'state': seg_df['st'].to_numpy(),
+            'county_id': pd.array([pd.NA] * len(seg_df), dtype='Int64'),
+        }),
+        pd.DataFrame({
+            'tornado_id': segment_county_df['tornado_segment_id'].map(segment_tornadoes).to_numpy(),
+            'state': segment_county_df['county_id'].map(county_states).to_numpy(),
+            'county_id': pd.array(segment_county_df['county_id'], dtype='Int64'),
+        }),
+    ], ignore_index=True).drop_duplicates(ignore_index=True)
+
+    ret['datetime'] = ret['tornado_id'].map(pd.Series(tor_df['datetime'].to_numpy(), index=tor_df['id'].to_numpy()))
+    ret['id'] = range(first_id, first_id + len(ret))
+    return ret
+
+
+def _parse_tornadoes(file):
+    df = spc_corrections.correct_tor_records(_read_spc(file))
+    _add_datetime(df)
+    return df
+
+
+def read_tornadoes():
+    table = cached_table(files.SPC_TOR, _parse_tornadoes, _read_spc, _add_datetime, spc_corrections)
+    return _parse_tornadoes(files.SPC_TOR) if table is None else table.to_pandas()
+
+
+def tornado_masks(df):
     is_complete_track = ((df.ns == 1) & (df.sn == 1)) | ((df.ns > 1) & (df.sn == 0))
     is_segment = df.sn == 1
     is_continuation = df.sg == -9
+    return is_complete_track & ~is_continuation, is_segment & ~is_continuation, is_continuation
 
-    columns = {
-        'state': 'st',
-        'magnitude': 'mag',
-        'fatalities': 'fat',
-        'injuries': 'inj',
-        'start_lat': 'slat',
-        'start_lon': 'slon',
-        'end_lat': 'elat',
-        'end_lon': 'elon',
-        'length': 'len',
-        'width': 'wid',
-        'datetime': 'datetime',
-        'loss': 'loss',
-        'closs': 'closs',
-        'magnitude_unk': 'fc'
-    }
-
-    ## save full track tornadoes
-    tor_df = df[is_complete_track & ~is_continuation].replace({np.nan: None})
-    tor_df['id'] = range(1, len(tor_df) + 1)
 
-    tor_records_df = tor_df[list(columns.values()) + ['id']]
-    tor_records_df.columns = list(columns.keys()) + ['id']
-    tor_records = tor_records_df.to_dict(orient='records')
+def tornado_frames(df, county_ref, first_ids=None):
+    # model -> rows to insert, in foreign key order, numbered from `first_ids` (or 1)
+    first_ids = first_ids or {}
+    is_tornado, is_segment, is_continuation = tornado_masks(df)
 
-    session.bulk_save_objects([Tornado(**rec) for rec in tor_records])
+    ## full track tornadoes
+    tor_df = df[is_tornado].copy()
+    tor_df['id'] = range(first_ids.get(Tornado, 1), first_ids.get(Tornado, 1) + len(tor_df))
 
-    ## save tornado segments
-    seg_df = df[is_segment & ~is_continuation].replace({np.nan: None})
-    # associate with parent tor id
-    seg_df = seg_df.merge(tor_df[['yr', 'om', 'id']], how='left').rename(columns={'id': 'tornado_id'})
-    seg_df['id'] = range(1, len(seg_df) + 1)
+    ## tornado segments, associated with their parent tor id
+    seg_df = df[is_segment].merge(
+        tor_df[['yr', 'om', 'id']].rename(columns={'id': 'tornado_id'}), on=['yr', 'om'], how='left'
+    )
+    seg_df['id'] = range(first_ids.get(TornadoSegment, 1), first_ids.get(TornadoSegment, 1) + len(seg_df))
 
     if seg_df.tornado_id.isnull().any():
         # there are orphan segments or something wrong with the DB. Time to correct the data
         raise ValueError('Segment mismatch with tornado! Re-evaluate the data')
+    seg_df['tornado_id'] = seg_df['tornado_id'].astype(int)
 
-    seg_records_df = seg_df[list(columns.values()) + ['id', 'tornado_id']]
-    seg_records_df.columns = list(columns.keys()) + ['id', 'tornado_id']
-    seg_records = seg_records_df.to_dict(orient='records')
-    seg_records = [TornadoSegment(**rec) for rec in seg_records]
-
-    # associate counties - this eventually has to be a slow loop, unfortunately
-    continuation_df = df[is_continuation].replace({np.nan: None})
-    continuation_df = continuation_df.merge(seg_df[['yr', 'om', 'st', 'id']], how='left')
+    ## county continuation records, associated with their segment
+    continuation_df = df[is_continuation].merge(seg_df[['yr', 'om', 'st', 'id']], on=['yr', 'om', 'st'], how='left')
 
     if continuation_df.id.isnull().any():
         raise ValueError('Continuation county record mismatch with county! Re-evaluate the data')
+    continuation_df['id'] = continuation_df['id'].astype(int)
+
+    # index both the full track and its segments
+    path_df = pd.concat([tor_df.rename(columns={'id': 'tornado_id'}), seg_df])
+    segment_county_df = _segment_counties(seg_df, continuation_df, county_ref, first_ids.get(TornadoSegmentCounty, 1))
+
+    return {
+        Tornado: _to_table(tor_df, _TORNADO_COLUMNS),
+        TornadoSegment: _to_table(seg_df, {**_TORNADO_COLUMNS, 'tornado_id': 'tornado_id'}),
+        TornadoSegmentCounty: segment_county_df,
+        TornadoGridCell: _path_grid_cells(path_df),
+        TornadoLocation: _tornado_locations(tor_df, seg_df, segment_county_df, county_ref,
+                                            first_ids.get(TornadoLocation, 1)),
+    }
+
 
-    # this ensures counties are inserted in order
-    continuation_df = continuation_df.sort_values(by='datetime')
+def point_frame(df, county_ref):
+    # from the coordinates as stored
+    df['grid_cell'] = grid_cell(df['slat'].round(2), df['slon'].round(2)).astype(int)
+
+    df = df.merge(county_ref[['state_fips', 'county_fips', 'county_id']], left_on=['stf', 'f1'],
+                  right_on=['state_fips', 'county_fips'], how='left')
+    # unmatched counties would otherwise turn the ids into floats
+    df['county_id'] = df['county_id'].astype('Int64')
+    return _to_table(df, _POINT_COLUMNS)
+
+
+def _next_id(session, model):
+    return (session.execute(select(func.max(model.id))).scalar() or 0) + 1
+
+
+def _renumber(ids, start):
+    # old id -> new id, handing out fresh ids from `start` on
+    return pd.Series(np.arange(start, start + len(ids)), index=ids.to_numpy())
+
+
+def tornado_fingerprints(frames):
+    # every record is fingerprinted under its parent tornado's year
+    tor_df, seg_df = frames[Tornado], frames[TornadoSegment]
+    tornado_years = pd.Series(tor_df['year'].to_numpy(), index=tor_df['id'].to_numpy())
+    segment_years = pd.Series(seg_df['tornado_id'].map(tornado_years).to_numpy(), index=seg_df['id'].to_numpy())
+
+    fingerprints = YearFingerprints()
+    fingerprints.update(tor_df, tor_df['year'])
+    fingerprints.update(seg_df, seg_df['tornado_id'].map(tornado_years))
+    county_df, cell_df, location_df = frames[TornadoSegmentCounty], frames[TornadoGridCell], frames[TornadoLocation]
+    fingerprints.update(county_df, county_df['tornado_segment_id'].map(segment_years))
+    fingerprints.update(cell_df, cell_df['tornado_id'].map(tornado_years))
+    fingerprints.update(location_df, location_df['tornado_id'].map(tornado_years))
+    return fingerprints
+
+
+def _delete_tornado_years(session, years):
+    tornado_ids = select(Tornado.id).where(Tornado.year.in_(years))
+    segment_ids = select(TornadoSegment.id).where(TornadoSegment.tornado_id.in_(tornado_ids))
+    # children first, for the foreign keys
+    session.execute(delete(TornadoSegmentCounty.__table__).where(
+        TornadoSegmentCounty.tornado_segment_id.in_(segment_ids)
+    ))
+    session.execute(delete(TornadoGridCell.__table__).where(TornadoGridCell.tornado_id.in_(tornado_ids)))
+    session.execute(delete(TornadoLocation.__table__).where(TornadoLocation.tornado_id.in_(tornado_ids)))
+    session.execute(delete(TornadoSegment.__table__).where(TornadoSegment.tornado_id.in_(tornado_ids)))
+    session.execute(delete(Tornado.__table__).where(Tornado.year.in_(years)))
+
+
+def _tornado_years(session, frames, years):
+    # only the given years, renumbered after the ids already in the DB
+    tor_df = frames[Tornado][frames[Tornado]['year'].isin(years)].copy()
+    seg_df = frames[TornadoSegment][frames[TornadoSegment]['tornado_id'].isin(tor_df['id'])].copy()
+    county_df = frames[TornadoSegmentCounty][
+        frames[TornadoSegmentCounty]['tornado_segment_id'].isin(seg_df['id'])
+    ].copy()
+    cell_df = frames[TornadoGridCell][frames[TornadoGridCell]['tornado_id'].isin(tor_df['id'])].copy()
+    location_df = frames[TornadoLocation][frames[TornadoLocation]['tornado_id'].isin(tor_df['id'])].copy()
+
+    tornado_ids = _renumber(tor_df['id'], _next_id(session, Tornado))
+    segment_ids = _renumber(seg_df['id'], _next_id(session, TornadoSegment))
+    tor_df['id'] = tor_df['id'].map(tornado_ids)
+    seg_df['id'], seg_df['tornado_id'] = seg_df['id'].map(segment_ids), seg_df['tornado_id'].map(tornado_ids)
+    county_df['tornado_segment_id'] = county_df['tornado_segment_id'].map(segment_ids)
+    county_df['id'] = _renumber(county_df['id'], _next_id(session, TornadoSegmentCounty)).to_numpy()
+    cell_df['tornado_id'] = cell_df['tornado_id'].map(tornado_ids)
+    location_df['tornado_id'] = location_df['tornado_id'].map(tornado_ids)
+    location_df['id'] = _renumber(location_df['id'], _next_id(session, TornadoLocation)).to_numpy()
+
+    return {
+        Tornado: tor_df, TornadoSegment: seg_df, TornadoSegmentCounty: county_df,
+        TornadoGridCell: cell_df, TornadoLocation: location_df,
+    }
 
-    county_order_tracker = {}
-    seg_county_records = []
 
-    def extract_counties(src_df):
-        county_id_cols = [f'county_id_{i}' for i in range(1, 5)]
-        county_df = src_df[['id'] + county_id_cols]
+def seed_tornadoes(session, county_ref, incremental=False):
+    # corrections can span years, so the whole file is always read and corrected
+    frames = tornado_frames(read_tornadoes(), county_ref)
+    fingerprints = tornado_fingerprints(frames).hexdigests()
 
-        for _, county_row in county_df.iterrows():
-            seg_id = county_row.id
-            for _, county_id in county_row.loc[county_df.columns != 'id'].items():
-                if county_id is not None:
-                    county_order = county_order_tracker.get(seg_id, 0) + 1
-                    seg_record = TornadoSegmentCounty(
-                        tornado_segment_id=seg_id,
-                        county_id=county_id,
-                        county_order=county_order
-                    )
-                    seg_county_records.append(seg_record)
-                    county_order_tracker[seg_id] = county_order
+    if incremental:
+        years = changed_years(stored_fingerprints(session, Tornado.__tablename__), fingerprints)
+        _delete_tornado_years(session, years)
+        frames = _tornado_years(session, frames, years)
 
-    extract_counties(seg_df)
-    extract_counties(continuation_df)
+    for model, df in frames.items():
+        insert_frame(session, model, df)
+    store_fingerprints(session, Tornado.__tablename__, fingerprints)
 
-    session.bulk_save_objects(seg_records + seg_county_records)
 
+def seed_hail(session, county_ref, incremental=False):
+    _seed_points(session, Hail, county_ref, files.SPC_HAIL, incremental)
 
-def seed_hail(session, county_ref):
-    records = _generate_point_records(county_ref, files.SPC_HAIL)
-    session.bulk_save_objects([Hail(id=idx, **rec) for idx, rec in enumerate(records, start=1)])
 
+def seed_wind(session, county_ref, incremental=False):
+    _seed_points(session, Wind, county_ref, files.SPC_WIND, incremental)
 
-def seed_wind(session, county_ref):
-    records = _generate_point_records(county_ref, files.SPC_WIND)
-    session.bulk_save_objects([Wind(id=idx, **rec) for idx, rec in enumerate(records, start=1)])
 
+def _parse_points(file):
+    df = _read_spc(file)
+    _add_datetime(df)
+    return df
 
-def _generate_point_records(county_ref, file):
-    columns = {
-        'state': 'st',
-        'magnitude': 'mag',
-        'fatalities': 'fat',
-        'injuries': 'inj',
-        'lat': 'slat',
-        'lon': 'slon',
-        'datetime': 'datetime',
-        'loss': 'loss',
-        'closs': 'closs'
-    }
-    df = pd.read_csv(file, parse_dates=[['date', 'time']], index_col=False)
 
-    dts = pd.to_timedelta(df['tz'].apply(lambda tz: 0 if tz == 9 else 6), unit='H')
-    converted = df['date_time'] + dts
-    df['datetime'] = converted
+def point_table(file):
+    return cached_table(file, _parse_points, _read_spc, _add_datetime)
+
+
+def point_frames(county_ref, file, start=0, rows=None):
+    # stream the (large) point report files through in chunks rather than loading them whole,
+    # optionally just `rows` records from record number `start` on
+    table = point_table(file)
+    if table is None:
+        chunks = _read_spc(file, chunksize=LoadConfig.BATCH_SIZE, skiprows=range(1, start + 1), nrows=rows)
+    else:
+        chunks = (batch.to_pandas() for batch in table.slice(start, rows).to_batches(LoadConfig.BATCH_SIZE))
+
+    for chunk in chunks:
+        if table is None:
+            _add_datetime(chunk)
+        yield point_frame(chunk, county_ref)
+
 
-    subset = df[['stf', 'f1'] + list(columns.values())]
-    subset = subset.merge(county_ref, left_on=['stf', 'f1'],
-                          right_on=['state_fips', 'county_fips'], how='left')
-    subset = subset[list(columns.values()) + ['county_id']]
-    subset.columns = list(columns.keys()) + ['county_id']
+def _seed_points(session, model, county_ref, file, incremental=False):
+    years = None
+    if incremental:
+        # a first pass to find which years changed, then only those are reloaded
+        fingerprints = YearFingerprints()
+        for df in point_frames(county_ref, file):
+            fingerprints.update(df, df['year'])
+        years = changed_years(stored_fingerprints(session, model.__tablename__), fingerprints.hexdigests())
+        session.execute(delete(model.__table__).where(model.year.in_(years)))
 
-    return subset.replace({np.nan: None}).to_dict(orient='records')
+    fingerprints = YearFingerprints()
+    next_id = _next_id(session, model)
+    for df in point_frames(county_ref, file):
+        fingerprints.update(df, df['year'])
+        if years is not None:
+            df = df[df['year'].isin(years)].copy()
+        df['id'] = range(next_id, next_id + len(df))
+        next_id += len(df)
+        insert_frame(session, model, df)
+    store_fingerprints(session, model.__tablename__, fingerprints.hexdigests())
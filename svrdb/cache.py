@@ -0,0 +1,135 @@
+import dataclasses
+import hashlib
+import json
+import logging
+import pickle
+import time
+from collections import OrderedDict
+from enum import Enum
+from threading import Lock
+from typing import Any, Awaitable, Callable
+
+from decouple import config
+
+from .dataset import dataset_version
+from .selection import Selection
+
+logger = logging.getLogger(__name__)
+
+class CacheConfig:
+    SIZE = config('RESPONSE_CACHE_SIZE', default=1024, cast=int)
+    TTL = config('RESPONSE_CACHE_TTL', default=3600, cast=int)
+    # e.g. redis://host:6379/0 to share the cache between API replicas
+    URL = config('RESPONSE_CACHE_URL', default=None)
+    # seconds to wait on Redis before treating the lookup as a miss
+    TIMEOUT = config('RESPONSE_CACHE_TIMEOUT', default=1, cast=float)
+
+
+# what `CacheBackend.get` returns for keys it doesn't have, as None can be a cached value
+MISSING = object()
+
+
+class CacheBackend:
+    async def get(self, key: str) -> Any:
+        raise NotImplementedError
+
+    async def set(self, key: str, value: Any):
+        raise NotImplementedError
+
+
+class LRUBackend(CacheBackend):
+    def __init__(self, maxsize: int, ttl: int):
+        self._maxsize = maxsize
+        self._ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    async def get(self, key):
+        with self._lock:
+            expires_at, value = self._entries.get(key, (None, MISSING))
+            if value is MISSING:
+                return MISSING
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return MISSING
+            self._entries.move_to_end(key)
+            return value
+
+    async def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self._ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._maxsize:
+                self._entries.popitem(last=False)
+
+
+class RedisBackend(CacheBackend):
+    def __init__(self, url: str, ttl: int):
+        # optional dependency, only needed for a shared cache
+        import redis.asyncio
+        self._client = redis.asyncio.Redis.from_url(
+            url, socket_timeout=CacheConfig.TIMEOUT, socket_connect_timeout=CacheConfig.TIMEOUT
+        )
+        self._errors = redis.RedisError
+        self._ttl = ttl
+
+    async def get(self, key):
+        # an unreachable cache is only a miss, the query can still be answered from the DB
+        try:
+            value = await self._client.get(key)
+        except self._errors as e:
+            logger.warning('cache lookup failed, treating it as a miss: %s', e)
+            return MISSING
+        return MISSING if value is None else pickle.loads(value)
+
+    async def set(self, key, value):
+        try:
+            await self._client.setex(key, self._ttl, pickle.dumps(value))
+        except self._errors as e:
+            logger.warning('caching failed: %s', e)
+
+
+def _canonical(value, name=None):
+    # order-insensitive filter lists (states, years, ...) normalize to the same key; ranges keep their order
+    if isinstance(value, Selection):
+        return {field: _canonical(value[field]) for field in sorted(value)}
+    if dataclasses.is_dataclass(value):
+        return {field.name: _canonical(getattr(value, field.name), field.name)
+                for field in dataclasses.fields(value) if getattr(value, field.name) is not None}
+    if isinstance(value, (list, tuple)):
+        values = [_canonical(v) for v in value]
+        if name is not None and not name.endswith('Range') and all(isinstance(v, (int, float, str)) for v in values):
+            return sorted(set(values))
+        return values
+    if isinstance(value, Enum):
+        return value.value
+    return value
+
+
+class ResponseCache:
+    """
+    Caches resolver results keyed on the normalized arguments and selection that produced
+    them, plus the dataset version: a reseed makes every earlier entry unreachable.
+    """
+
+    def __init__(self, backend: CacheBackend):
+        self._backend = backend
+
+    @staticmethod
+    def _key(namespace: str, version: str, parts: Any) -> str:
+        canonical = json.dumps(_canonical(parts), sort_keys=True, default=str)
+        return f'svrdb:{namespace}:{version}:{hashlib.sha256(canonical.encode()).hexdigest()}'
+
+    async def get_or_fetch(self, namespace: str, parts: Any, fetch: Callable[[], Awaitable[Any]]):
+        key = self._key(namespace, await dataset_version.current(), parts)
+        value = await self._backend.get(key)
+        if value is MISSING:
+            value = await fetch()
+            await self._backend.set(key, value)
+        return value
+
+
+response_cache = ResponseCache(
+    RedisBackend(CacheConfig.URL, CacheConfig.TTL) if CacheConfig.URL
+    else LRUBackend(CacheConfig.SIZE, CacheConfig.TTL)
+)
@@ -0,0 +1,55 @@
+from threading import Lock
+from types import MappingProxyType
+from typing import Iterable, List, Mapping, NamedTuple, Optional
+
+from .models import County, get_session
+
+
+class CountyRecord(NamedTuple):
+    id: int
+    state: str
+    state_fips: int
+    county_fips: int
+    county: str
+
+
+class _CountyCache:
+    """
+    The county table is a small, static dimension, so it is kept in memory as an
+    immutable id -> county map instead of being joined or queried per request.
+    """
+
+    def __init__(self):
+        self._counties: Optional[Mapping[int, CountyRecord]] = None
+        self._ids_by_fips: Mapping[int, int] = MappingProxyType({})
+        self._lock = Lock()
+
+    def reload(self):
+        with get_session() as session:
+            queried = session.query(
+                County.id, County.state, County.state_fips, County.county_fips, County.county
+            )
+            counties = {row.id: CountyRecord(*row) for row in queried}
+        # swap in the whole map at once so concurrent readers never see a partial load
+        self._ids_by_fips = MappingProxyType({
+            county.state_fips * 1000 + county.county_fips: county.id for county in counties.values()
+        })
+        self._counties = MappingProxyType(counties)
+
+    def _get_counties(self) -> Mapping[int, CountyRecord]:
+        if self._counties is None:
+            with self._lock:
+                if self._counties is None:
+                    self.reload()
+        return self._counties
+
+    def get(self, id: int) -> Optional[CountyRecord]:
+        return self._get_counties().get(id)
+
+    def ids_for_fips(self, fips: Iterable[int]) -> List[int]:
+        # 5 digit state + county FIPS codes, unknown codes are skipped
+        self._get_counties()
+        return [self._ids_by_fips[code] for code in fips if code in self._ids_by_fips]
+
+
+county_cache = _CountyCache()
@@ -0,0 +1,14 @@
+import base64
+from datetime import datetime
+
+
+def encode_cursor(dt: datetime, id: int) -> str:
+    return base64.urlsafe_b64encode(f'{dt.isoformat()}|{id}'.encode()).decode()
+
+
+def decode_cursor(cursor: str):
+    try:
+        dt, id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        return datetime.fromisoformat(dt), int(id)
+    except ValueError:
+        raise ValueError(f'Invalid pagination cursor: {cursor}')
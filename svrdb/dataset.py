@@ -0,0 +1,50 @@
+import hashlib
+import time
+from datetime import datetime
+
+from decouple import config
+from sqlalchemy import select
+
+from .counties import county_cache
+from .models import County, DatasetVersion, SeedFingerprint, get_async_session
+
+
+def bump_dataset_version(session):
+    # derived from what was seeded (the per year fingerprints, plus the counties), so reseeding unchanged data
+    # keeps the version, and with it every cache entry and ETag keyed on it
+    digest = hashlib.sha256()
+    fingerprints = session.execute(
+        select(SeedFingerprint.dataset, SeedFingerprint.year, SeedFingerprint.fingerprint)
+        .order_by(SeedFingerprint.dataset, SeedFingerprint.year)
+    )
+    counties = session.execute(
+        select(County.id, County.state, County.state_fips, County.county_fips, County.county).order_by(County.id)
+    )
+    for row in [*fingerprints, *counties]:
+        digest.update(repr(tuple(row)).encode())
+    session.merge(DatasetVersion(id=1, version=digest.hexdigest()[:32], seeded_at=datetime.utcnow()))
+
+
+class _DatasetVersionTracker:
+    """
+    Tracks the version stamped by the last seed, re-reading it at most every `ttl` seconds,
+    so that caches can key on it and go stale the moment the data is reseeded.
+    """
+
+    def __init__(self, ttl: float):
+        self._ttl = ttl
+        self._version = None
+        self._checked_at = 0.0
+
+    async def current(self) -> str:
+        if time.monotonic() - self._checked_at > self._ttl:
+            async with get_async_session() as session:
+                version = (await session.execute(select(DatasetVersion.version))).scalar()
+            if self._version is not None and version != self._version:
+                # the DB was reseeded under us
+                county_cache.reload()
+            self._version, self._checked_at = version, time.monotonic()
+        return self._version
+
+
+dataset_version = _DatasetVersionTracker(ttl=config('DATASET_VERSION_TTL', default=10, cast=float))
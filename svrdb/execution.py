@@ -0,0 +1,118 @@
+from asyncio import gather
+
+import strawberry
+from graphql import ExecutionContext, GraphQLScalarType, Undefined, get_nullable_type, is_non_null_type
+from graphql.pyutils import Path
+from strawberry.extensions.directives import DirectivesExtensionSync
+from strawberry.schema.execute import execute
+from strawberry.types import ExecutionContext as StrawberryExecutionContext
+
+
+def _plain_fields(schema, parent_type, fields):
+    # response name -> (attribute, serializer, nullable) of the scalar fields read straight off an attribute:
+    # no resolver, permissions, arguments or directives
+    strawberry_schema = schema._strawberry_schema
+    definition = strawberry_schema.get_type_by_name(parent_type.name)
+    if definition is None:
+        return {}
+    strawberry_fields = {strawberry_schema.config.name_converter.from_field(field): field
+                         for field in definition.fields}
+
+    ret = {}
+    for response_name, field_nodes in fields.items():
+        name = field_nodes[0].name.value
+        field = strawberry_fields.get(name)
+        if field is None or field.base_resolver is not None or field.permission_classes:
+            continue
+        if any(node.arguments or node.directives for node in field_nodes):
+            continue
+        field_type = parent_type.fields[name].type
+        scalar = get_nullable_type(field_type)
+        if isinstance(scalar, GraphQLScalarType):
+            ret[response_name] = (field.python_name, scalar.serialize, not is_non_null_type(field_type))
+    return ret
+
+
+def _serialize(source, attribute, serialize, nullable):
+    # anything out of the ordinary (nulls in non-null fields, values the scalar rejects) is left to the
+    # regular path, which reports it
+    try:
+        value = getattr(source, attribute)
+        if value is None:
+            return None if nullable else Undefined
+        return serialize(value)
+    except Exception:
+        return Undefined
+
+
+class PlainFieldsExecutionContext(ExecutionContext):
+    """
+    Serializes plain scalar fields (see `_plain_fields`) in place instead of resolving each one through the
+    resolver middleware (our extensions) and completing it: a page of 10000 events has 100000 of them or more,
+    and none of the extensions look at them.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._plain_fields_cache = {}
+
+    def execute_fields(self, parent_type, source_value, path, fields):
+        # the fields of a selection set are collected once per execution (and then cached), so the id of
+        # their dict identifies them for as long as the execution runs
+        key = (parent_type, id(fields))
+        plain_fields = self._plain_fields_cache.get(key)
+        if plain_fields is None:
+            plain_fields = self._plain_fields_cache[key] = _plain_fields(self.schema, parent_type, fields)
+
+        results = {}
+        awaitable_fields = []
+        for response_name, field_nodes in fields.items():
+            plain_field = plain_fields.get(response_name)
+            if plain_field is not None:
+                value = _serialize(source_value, *plain_field)
+                if value is not Undefined:
+                    results[response_name] = value
+                    continue
+            result = self.resolve_field(parent_type, source_value, field_nodes,
+                                        Path(path, response_name, parent_type.name))
+            if result is not Undefined:
+                results[response_name] = result
+                if self.is_awaitable(result):
+                    awaitable_fields.append(response_name)
+
+        if not awaitable_fields:
+            return results
+
+        async def get_results():
+            results.update(zip(awaitable_fields, await gather(*(results[field] for field in awaitable_fields))))
+            return results
+
+        return get_results()
+
+
+class Schema(strawberry.Schema):
+    """
+    Strawberry's async execution wraps every field's resolver in a coroutine to apply custom directives,
+    so each field of each row became a task of its own. We have no custom directives, and the sync
+    version of that wrapper leaves sync resolvers sync: only the query fields are awaited.
+    """
+
+    async def execute(self, query, variable_values=None, context_value=None, root_value=None, operation_name=None):
+        execution_context = StrawberryExecutionContext(
+            query=query,
+            schema=self,
+            context=context_value,
+            root_value=root_value,
+            variables=variable_values,
+            provided_operation_name=operation_name,
+        )
+        result = await execute(
+            self._schema,
+            query,
+            extensions=list(self.extensions) + [DirectivesExtensionSync],
+            execution_context_class=self.execution_context_class,
+            execution_context=execution_context,
+        )
+        if result.errors:
+            self.process_errors(result.errors, execution_context=execution_context)
+        return result
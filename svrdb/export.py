@@ -0,0 +1,165 @@
+import csv
+import dataclasses
+import io
+import json
+import typing
+from datetime import datetime
+from decimal import Decimal
+from typing import Union
+
+from decouple import config
+from sqlalchemy import Boolean, DateTime, Float, Integer, Numeric
+from fastapi import APIRouter, Body, HTTPException
+from fastapi.responses import StreamingResponse
+
+from .fetch import TornadoFetch, HailFetch, WindFetch
+from .inputs import TornadoFilter, HailFilter, WindFilter
+from .replicas import stream
+
+BATCH_SIZE = config('EXPORT_BATCH_SIZE', default=5000, cast=int)
+
+_EXPORTS = {
+    'tornado': (TornadoFetch, TornadoFilter),
+    'hail': (HailFetch, HailFilter),
+    'wind': (WindFetch, WindFilter),
+}
+
+# what JSON values each scalar accepts, as GraphQL does: ints for floats, but no bools for numbers
+_SCALARS = {
+    bool: (bool,),
+    int: (int,),
+    float: (int, float),
+    str: (str,),
+}
+
+router = APIRouter()
+
+
+def _to_input(value, annotation):
+    # JSON -> strawberry input, mirroring what GraphQL does for the `filter` argument
+    if value is None:
+        return None
+    if typing.get_origin(annotation) is Union:
+        return _to_input(value, next(arg for arg in typing.get_args(annotation) if arg is not type(None)))
+    if typing.get_origin(annotation) is list:
+        _check(value, list, 'a list')
+        return [_to_input(v, typing.get_args(annotation)[0]) for v in value]
+    if annotation is datetime:
+        _check(value, str, 'an ISO 8601 datetime')
+        return datetime.fromisoformat(value)
+    if dataclasses.is_dataclass(annotation):
+        _check(value, dict, 'an object')
+        hints = typing.get_type_hints(annotation)
+        return annotation(**{key: _to_input(v, hints[key]) for key, v in value.items()})
+    if annotation in _SCALARS:
+        if (isinstance(value, bool) and annotation is not bool) or not isinstance(value, _SCALARS[annotation]):
+            raise TypeError(f'expected {annotation.__name__}, got {json.dumps(value)}')
+        return annotation(value)
+    return value
+
+
+def _check(value, type_, expected):
+    if not isinstance(value, type_):
+        raise TypeError(f'expected {expected}, got {json.dumps(value)}')
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f'{type(value)} is not JSON serializable')
+
+
+def _ndjson(columns, batches):
+    keys = [col.key for col in columns]
+    for rows in batches:
+        yield ''.join(json.dumps(dict(zip(keys, row)), default=_json_default) + '\n' for row in rows)
+
+
+def _csv(columns, batches):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([col.key for col in columns])
+    for rows in batches:
+        writer.writerows(rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+class _Chunks(io.RawIOBase):
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self._chunks.append(bytes(b))
+        return len(b)
+
+    def drain(self):
+        ret, self._chunks = b''.join(self._chunks), []
+        return ret
+
+
+def _arrow_type(pa, sql_type):
+    # the schema comes from the table, not from the first batch, so sparse (nullable) columns stay typed
+    if isinstance(sql_type, Boolean):
+        return pa.bool_()
+    if isinstance(sql_type, Integer):
+        return pa.int64()
+    if isinstance(sql_type, Float):
+        return pa.float64()
+    if isinstance(sql_type, Numeric):
+        return pa.decimal128(sql_type.precision, sql_type.scale)
+    if isinstance(sql_type, DateTime):
+        return pa.timestamp('us')
+    return pa.string()
+
+
+def _arrow(columns, batches):
+    # optional dependency, only needed for Arrow exports
+    import pyarrow as pa
+
+    schema = pa.schema([(col.key, _arrow_type(pa, col.type)) for col in columns])
+    sink = _Chunks()
+    writer = pa.ipc.new_stream(sink, schema)
+    for rows in batches:
+        writer.write_batch(pa.RecordBatch.from_pydict(dict(zip(schema.names, zip(*rows))), schema=schema))
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+
+_FORMATS = {
+    'ndjson': (_ndjson, 'application/x-ndjson'),
+    'csv': (_csv, 'text/csv'),
+    'arrow': (_arrow, 'application/vnd.apache.arrow.stream'),
+}
+
+
+def _stream(stmt, write):
+    # server-side cursor, so only one batch of rows is ever held in memory
+    with stream(stmt.execution_options(stream_results=True, yield_per=BATCH_SIZE)) as result:
+        yield from write(list(stmt.selected_columns), result.partitions(BATCH_SIZE))
+
+
+@router.post('/{event}')
+def export(event: str, format: str = 'ndjson', filter: dict = Body(None, embed=True)):
+    if event not in _EXPORTS:
+        raise HTTPException(status_code=404, detail=f'Unknown event type: {event}')
+    if format not in _FORMATS:
+        raise HTTPException(status_code=400, detail=f'Unknown export format: {format}')
+
+    fetch_cls, filter_cls = _EXPORTS[event]
+    try:
+        parsed = _to_input(filter, filter_cls)
+        # before any of the response goes out, so a filter the fetch rejects is still a 400
+        stmt = fetch_cls(session=None).export_statement(parsed)
+    except (KeyError, TypeError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=f'Invalid filter: {e}')
+
+    write, media_type = _FORMATS[format]
+    return StreamingResponse(_stream(stmt, write), media_type=media_type)
@@ -1,140 +1,411 @@
-from typing import Any
-
-from sqlalchemy import column, extract
-from sqlalchemy.orm import Session, selectinload
-
-from .inputs import SpatialFilter, TemporalFilter, TornadoFilter, HailFilter, WindFilter, Pagination
-from .models import Base, Tornado, TornadoSegment, Hail, Wind, TornadoSegmentCounty
+import dataclasses
+from datetime import MAXYEAR, MINYEAR, datetime
+from typing import Any, List, Union
+
+from decouple import config
+from sqlalchemy import inspect, and_, or_, select, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from .counties import county_cache
+from .cursor import decode_cursor
+from .inputs import (
+    SpatialFilter, TemporalFilter, TornadoFilter, HailFilter, WindFilter, Pagination, StatsGroupBy
+)
+from .geo import spatial_shapes
+from .metrics import FETCH, FETCH_ROWS, POOL_WAIT
+from .models import (
+    Base, Tornado, TornadoGridCell, TornadoLocation, Hail, Wind, TornadoRollup, HailRollup, WindRollup
+)
+from .selection import Selection
+
+
+class PaginationConfig:
+    DEFAULT_LIMIT = config('QUERY_DEFAULT_LIMIT', default=1000, cast=int)
+    # the largest page each query field hands out
+    MAX_TORNADO_LIMIT = config('QUERY_MAX_TORNADO_LIMIT', default=5000, cast=int)
+    MAX_HAIL_LIMIT = config('QUERY_MAX_HAIL_LIMIT', default=10000, cast=int)
+    MAX_WIND_LIMIT = config('QUERY_MAX_WIND_LIMIT', default=10000, cast=int)
 
 
 class _ModelFetch:
-    def __init__(self, model: Base, session: Session):
+    # filters that line up with the rollup's dimensions, any other one has to go to the raw events
+    _rollup_filters = frozenset()
+    max_limit = PaginationConfig.DEFAULT_LIMIT
+
+    def __init__(self, model: Base, session: Union[Session, AsyncSession], rollup: Base = None):
         self._model = model
         self._session = session
+        self._rollup = rollup
 
     def _where_args(self, _filter: Any):
         return []
 
-    def fetch(self, filter: Any, order_by: str, pagination: Pagination):
+    def _rollup_where_args(self, _filter: Any):
+        return []
+
+    def _seek_args(self, order_by: str, after: str):
+        # keyset pagination: resume right after the (order_by, id) of the cursor,
+        # so deep pages cost the same as the first one
+        order_value, id = decode_cursor(after)
+        order_col = getattr(self._model, order_by)
+        return [or_(order_col > order_value, and_(order_col == order_value, self._model.id > id))]
+
+    def limit_and_offset(self, pagination: Pagination):
         limit, offset = _to_limit_and_offset(pagination)
-        if filter is None:
-            return self._session.query(self._model).order_by(order_by).limit(limit).offset(offset)
-        return self._session.query(self._model)\
-            .where(*self._where_args(filter)).order_by(order_by).limit(limit).offset(offset)
+        if not 0 < limit <= self.max_limit:
+            raise ValueError(f'Pagination limit must be between 1 and {self.max_limit}!')
+        if offset < 0:
+            raise ValueError('Pagination offset must not be negative!')
+        return limit, offset
+
+    def statement(self, filter: Any, order_by: str, pagination: Pagination, selection: Selection = None):
+        limit, offset = self.limit_and_offset(pagination)
+        # plain rows of the selected columns: nothing is written back, so ORM objects would only cost time
+        # (relationships are loaded for the whole page afterwards, see loaders.py)
+        stmt = select(*_selected_columns(self._model, selection))
+        if filter is not None:
+            stmt = stmt.where(*self._where_args(filter))
+        if pagination is not None and pagination.after is not None:
+            stmt = stmt.where(*self._seek_args(order_by, pagination.after))
+        # id breaks ties between events with the same timestamp so pages never shift
+        return stmt.order_by(getattr(self._model, order_by), self._model.id).limit(limit).offset(offset)
+
+    def fetch(self, filter: Any, order_by: str, pagination: Pagination, selection: Selection = None):
+        return self._session.execute(self.statement(filter, order_by, pagination, selection)).all()
+
+    async def _execute_async(self, stmt, filter: Any, phase: str):
+        if not self._session.sync_session.in_transaction():
+            # the session checks its connection out on the first statement
+            with POOL_WAIT.time():
+                await self._session.connection()
+        with FETCH.time(table=self._model.__tablename__, phase=phase):
+            return await self._session.execute(stmt.execution_options(svrdb_filter=filter))
+
+    async def fetch_async(self, filter: Any, order_by: str, pagination: Pagination, selection: Selection = None):
+        queried = await self._execute_async(self.statement(filter, order_by, pagination, selection), filter, 'execute')
+        with FETCH.time(table=self._model.__tablename__, phase='load'):
+            events = queried.all()
+        FETCH_ROWS.observe(len(events), table=self._model.__tablename__)
+        return events
+
+    def count_statement(self, filter: Any, order_by: str, pagination: Pagination):
+        # how many rows the page will hold: the LIMIT stops the count at the page size,
+        # and without the ORDER BY nothing gets sorted
+        page = self.statement(filter, order_by, pagination).order_by(None).with_only_columns(self._model.id)
+        return select(func.count()).select_from(page.subquery())
+
+    async def count_async(self, filter: Any, order_by: str, pagination: Pagination):
+        return (await self._execute_async(self.count_statement(filter, order_by, pagination), filter, 'count')).scalar()
+
+    def export_statement(self, filter: Any):
+        # every stored column except the spatial index
+        stmt = select(*[col for col in self._model.__table__.columns if col.key != 'grid_cell'])
+        if filter is not None:
+            stmt = stmt.where(*self._where_args(filter))
+        return stmt.order_by(self._model.datetime, self._model.id)
+
+    def _stats_columns(self):
+        return [
+            func.count().label('count'),
+            func.coalesce(func.sum(self._model.fatalities), 0).label('fatalities'),
+            func.coalesce(func.sum(self._model.injuries), 0).label('injuries'),
+            func.coalesce(func.sum(self._model.loss), 0).label('loss'),
+            func.coalesce(func.sum(self._model.closs), 0).label('closs'),
+        ]
+
+    def _rollup_stats_columns(self):
+        return [
+            func.coalesce(func.sum(self._rollup.count), 0).label('count'),
+            func.coalesce(func.sum(self._rollup.fatalities), 0).label('fatalities'),
+            func.coalesce(func.sum(self._rollup.injuries), 0).label('injuries'),
+            func.coalesce(func.sum(self._rollup.loss), 0).label('loss'),
+            func.coalesce(func.sum(self._rollup.closs), 0).label('closs'),
+        ]
+
+    def _fits_rollup(self, filter: Any, group_by: List[StatsGroupBy]):
+        if self._rollup is None or any(not hasattr(self._rollup, group.value) for group in group_by or []):
+            return False
+        return filter is None or all(
+            getattr(filter, field.name) is None
+            for field in dataclasses.fields(filter) if field.name not in self._rollup_filters
+        )
+
+    def stats_statement(self, filter: Any, group_by: List[StatsGroupBy]):
+        # totals by year/month/state/magnitude are precomputed, only finer grained stats scan the events
+        if self._fits_rollup(filter, group_by):
+            source, columns = self._rollup, self._rollup_stats_columns()
+            where_args = self._rollup_where_args
+        else:
+            source, columns = self._model, self._stats_columns()
+            where_args = self._where_args
+
+        group_cols = [getattr(source, group.value) for group in group_by or []]
+        stmt = select(*group_cols, *columns)
+        if filter is not None:
+            stmt = stmt.where(*where_args(filter))
+        return stmt.group_by(*group_cols).order_by(*group_cols)
+
+    async def fetch_stats_async(self, filter: Any, group_by: List[StatsGroupBy]):
+        return (await self._execute_async(self.stats_statement(filter, group_by), filter, 'stats')).all()
 
 
 class _SpatialFetch(_ModelFetch):
+    _rollup_filters = frozenset({'states'})
+
     def _where_args(self, filter: SpatialFilter):
+        return self._state_args(filter) + self._county_args(filter) + self._shape_args(filter)
+
+    def _rollup_where_args(self, filter: SpatialFilter):
         ret = []
         if filter.states is not None:
-            ret.append(column('state').in_(filter.states))
+            ret.append(self._rollup.state.in_(filter.states))
+        return ret
+
+    def _state_args(self, filter: SpatialFilter):
+        ret = []
+        if filter.states is not None:
+            ret.append(self._model.state.in_(filter.states))
+        return ret
+
+    def _county_args(self, filter: SpatialFilter):
+        ret = []
+        if filter.countyFips is not None:
+            ret.append(self._model.county_id.in_(county_cache.ids_for_fips(filter.countyFips)))
+        return ret
+
+    def _shape_args(self, filter: SpatialFilter):
+        ret = []
+        for shape in spatial_shapes(filter):
+            # grid cells narrow down candidates through their index, the exact predicate trims the cell edges
+            cells = shape.grid_cells()
+            if cells is not None:
+                ret.append(self._model.grid_cell.in_(cells))
+            ret.append(shape.contains_point(self._model.lat, self._model.lon))
         return ret
 
 
 class _TemporalFetch(_ModelFetch):
+    _rollup_filters = frozenset({'years', 'months'})
+
+    def _rollup_where_args(self, filter: TemporalFilter):
+        ret = []
+        if filter.years is not None:
+            ret.append(self._rollup.year.in_(filter.years))
+        if filter.months is not None:
+            ret.append(self._rollup.month.in_(filter.months))
+        return ret
+
     def _where_args(self, filter: TemporalFilter):
         ret = []
         if filter.datetimeRange is not None:
-            ret += parse_range('datetime', filter.datetimeRange)
+            ret += parse_range(self._model.datetime, filter.datetimeRange)
         if filter.years is not None:
-            ret.append(extract('year', column('datetime')).in_(filter.years))
-        if filter.months is not None:
-            ret.append(extract('month', column('datetime')).in_(filter.months))
+            ret += parse_years_and_months(self._model, filter.years, filter.months)
+        elif filter.months is not None:
+            ret.append(self._model.month.in_(filter.months))
         if filter.days is not None:
-            ret.append(extract('day', column('datetime')).in_(filter.days))
+            ret.append(self._model.day.in_(filter.days))
         if filter.hours is not None:
-            ret.append(extract('hour', column('datetime')).in_(filter.hours))
+            ret.append(self._model.hour.in_(filter.hours))
         return ret
 
 
 class TornadoFetch(_SpatialFetch, _TemporalFetch):
-    def __init__(self, session: Session):
-        super().__init__(model=Tornado, session=session)
+    # tornado states match any segment's state, while the rollup only knows the touchdown state
+    _rollup_filters = _TemporalFetch._rollup_filters | {'efs'}
+    max_limit = PaginationConfig.MAX_TORNADO_LIMIT
+
+    def __init__(self, session: Union[Session, AsyncSession]):
+        super().__init__(model=Tornado, session=session, rollup=TornadoRollup)
+
+    def _rollup_where_args(self, filter: TornadoFilter):
+        others = []
+        if filter.efs is not None:
+            others.append(self._rollup.magnitude.in_(filter.efs))
+        return _TemporalFetch._rollup_where_args(self, filter) + others
 
     def _where_args(self, filter: TornadoFilter):
         temporal_wheres = _TemporalFetch._where_args(self, filter)
-
-        # TODO: we have to modify this when spatial filters is more than just states
-        spatial_wheres = []
-        if filter.states is None:
-            spatial_wheres += _SpatialFetch._where_args(self, filter)
-        else:
-            # override state `where` behavior we want to query for segment states not
-            # parent tornado states (which are just the touchdown states)
-            # unfortunately, due to column conflicts between Tornado (parent)
-            # and TornadoSegment (child), explict join gets screwy...
-            # workaround is to subquery for tornado_id list
-            # and select tornado by those ids
-            subquery = self._session.query(TornadoSegment.tornado_id).where(
-                TornadoSegment.state.in_(filter.states)
-            )
-            spatial_wheres.append(column('id').in_(subquery))
+        spatial_wheres = _SpatialFetch._where_args(self, filter)
 
         others = []
         if filter.efs is not None:
-            others.append(column('magnitude').in_(filter.efs))
+            others.append(Tornado.magnitude.in_(filter.efs))
         if filter.pathLengthRange is not None:
-            others += parse_range('length', filter.pathLengthRange)
+            others += parse_range(Tornado.length, filter.pathLengthRange)
 
         return temporal_wheres + spatial_wheres + others
 
-    def fetch(self, filter: TornadoFilter, order_by: str, pagination: Pagination):
+    def _state_args(self, filter: TornadoFilter):
+        ret = []
+        if filter.states is not None:
+            # override state `where` behavior we want to query for segment states not
+            # parent tornado states (which are just the touchdown states),
+            # looked up in the denormalized tornado_location index
+            subquery = select(TornadoLocation.tornado_id).where(
+                TornadoLocation.state.in_(filter.states)
+            )
+            ret.append(Tornado.id.in_(subquery))
+        return ret
+
+    def _county_args(self, filter: TornadoFilter):
+        # any county along the path, not just the touchdown county
+        ret = []
+        if filter.countyFips is not None:
+            subquery = select(TornadoLocation.tornado_id).where(
+                TornadoLocation.county_id.in_(county_cache.ids_for_fips(filter.countyFips))
+            )
+            ret.append(Tornado.id.in_(subquery))
+        return ret
+
+    def _shape_args(self, filter: TornadoFilter):
+        # match anywhere along the path, not just the touchdown point
+        ret = []
+        for shape in spatial_shapes(filter):
+            # paths are rasterized by sampling, so look one cell beyond the shape for corner-clipping paths
+            cells = shape.grid_cells(margin=1)
+            if cells is not None:
+                subquery = select(TornadoGridCell.tornado_id).where(TornadoGridCell.cell.in_(cells))
+                ret.append(Tornado.id.in_(subquery))
+            ret.append(shape.touches_path(Tornado.start_lat, Tornado.start_lon, Tornado.end_lat, Tornado.end_lon))
+        return ret
+
+    def _stats_columns(self):
+        return super()._stats_columns() + [func.coalesce(func.sum(Tornado.length), 0).label('length')]
+
+    def _rollup_stats_columns(self):
+        return super()._rollup_stats_columns() + [func.coalesce(func.sum(TornadoRollup.length), 0).label('length')]
+
+    def statement(self, filter: TornadoFilter, order_by: str, pagination: Pagination, selection: Selection = None):
         if filter is None:
             raise ValueError('TornadoFilter must not not be null!')
 
-        limit, offset = _to_limit_and_offset(pagination)
-
-        return self._session.query(self._model)\
-            .options(selectinload(Tornado.segments)
-                     .joinedload(TornadoSegment.counties)
-                     .joinedload(TornadoSegmentCounty.county))\
-            .where(*self._where_args(filter))\
-            .order_by(order_by).limit(limit).offset(offset)
+        return super().statement(filter, order_by, pagination, selection)
 
 
 class HailFetch(_SpatialFetch, _TemporalFetch):
-    def __init__(self, session: Session):
-        super().__init__(model=Hail, session=session)
+    _rollup_filters = _SpatialFetch._rollup_filters | _TemporalFetch._rollup_filters | {'sizeRange'}
+    max_limit = PaginationConfig.MAX_HAIL_LIMIT
+
+    def __init__(self, session: Union[Session, AsyncSession]):
+        super().__init__(model=Hail, session=session, rollup=HailRollup)
+
+    def _rollup_where_args(self, filter: HailFilter):
+        others = []
+        if filter.sizeRange is not None:
+            others += parse_range(HailRollup.magnitude, filter.sizeRange)
+
+        return others + _TemporalFetch._rollup_where_args(self, filter) + _SpatialFetch._rollup_where_args(self, filter)
 
     def _where_args(self, filter: HailFilter):
         others = []
         if filter.sizeRange is not None:
-            others += parse_range('magnitude', filter.sizeRange)
+            others += parse_range(Hail.magnitude, filter.sizeRange)
 
         return others + _TemporalFetch._where_args(self, filter) + _SpatialFetch._where_args(self, filter)
 
 
 class WindFetch(_SpatialFetch, _TemporalFetch):
-    def __init__(self, session: Session):
-        super().__init__(model=Wind, session=session)
+    _rollup_filters = _SpatialFetch._rollup_filters | _TemporalFetch._rollup_filters | {'windSpeedRange'}
+    max_limit = PaginationConfig.MAX_WIND_LIMIT
+
+    def __init__(self, session: Union[Session, AsyncSession]):
+        super().__init__(model=Wind, session=session, rollup=WindRollup)
+
+    def _rollup_where_args(self, filter: WindFilter):
+        others = []
+        if filter.windSpeedRange is not None:
+            others += parse_range(WindRollup.magnitude, filter.windSpeedRange)
+
+        return others + _TemporalFetch._rollup_where_args(self, filter) + _SpatialFetch._rollup_where_args(self, filter)
 
     def _where_args(self, filter: WindFilter):
         others = []
         if filter.windSpeedRange is not None:
-            others += parse_range('magnitude', filter.windSpeedRange)
+            others += parse_range(Wind.magnitude, filter.windSpeedRange)
 
         return others + _TemporalFetch._where_args(self, filter) + _SpatialFetch._where_args(self, filter)
 
 
+# fields computed from other columns rather than mapped one to one
+_DERIVED_FIELDS = {
+    'cursor': ('id', 'datetime'),
+}
+
+
+def _selected_columns(model, selection: Selection):
+    if selection is None:
+        return [getattr(model, attr.key) for attr in inspect(model).column_attrs]
+    # always load the primary key, plus whatever foreign keys the selected relationships hang off of
+    keys = set(selection) | {'id'}
+    for field, columns in _DERIVED_FIELDS.items():
+        if field in selection:
+            keys.update(columns)
+    for rel in inspect(model).relationships:
+        if rel.key in selection:
+            keys.update(col.key for col in rel.local_columns)
+    return [getattr(model, attr.key) for attr in inspect(model).column_attrs if attr.key in keys]
+
+
 def parse_range(col, lst):
     if not lst:
         return []
     if len(lst) == 1:
-        return [column(col) == lst[0]]
+        return [col == lst[0]]
     else:
         ret = []
         rng_start, rng_end = tuple(lst[:2])
         if rng_start is not None:
-            ret.append(column(col) >= rng_start)
+            ret.append(col >= rng_start)
         if rng_end is not None:
             ret.append(
-                column(col) <= rng_end if rng_start is None else column(col) < rng_end
+                col <= rng_end if rng_start is None else col < rng_end
             )
         return ret
 
 
+# past this many OR'ed ranges the planner does better with the indexed year/month columns
+_MAX_DATETIME_RANGES = 50
+
+
+def parse_years_and_months(model, years, months=None):
+    # compile years (and months within them) into `datetime` ranges, which can use the datetime index,
+    # merging contiguous year/months into one range
+    if months:
+        ranges = _to_datetime_ranges(years, months)
+        if 0 < len(ranges) <= _MAX_DATETIME_RANGES:
+            return [_any_datetime_range(model, ranges)]
+
+    ranges = _to_datetime_ranges(years, range(1, 13))
+    ret = [_any_datetime_range(model, ranges)] if 0 < len(ranges) <= _MAX_DATETIME_RANGES else [
+        model.year.in_(years)
+    ]
+    if months:
+        ret.append(model.month.in_(months))
+    return ret
+
+
+def _to_datetime_ranges(years, months):
+    # years and months no date has (like month 13) match nothing, as they would through `year` and `month`
+    year_months = {(yr, mo) for yr in years for mo in months if MINYEAR <= yr < MAXYEAR and 1 <= mo <= 12}
+    ranges = []
+    for yr, mo in sorted(year_months):
+        start = datetime(yr, mo, 1)
+        end = datetime(yr + mo // 12, mo % 12 + 1, 1)
+        if ranges and ranges[-1][1] == start:
+            ranges[-1][1] = end
+        else:
+            ranges.append([start, end])
+    return ranges
+
+
+def _any_datetime_range(model, ranges):
+    return or_(*[and_(model.datetime >= start, model.datetime < end) for start, end in ranges])
+
+
 def _to_limit_and_offset(pagination):
     if not pagination:
-        return 1000, 0
+        return PaginationConfig.DEFAULT_LIMIT, 0
 
-    return pagination.limit or 1000, pagination.offset or 0
+    return pagination.limit or PaginationConfig.DEFAULT_LIMIT, pagination.offset or 0
@@ -0,0 +1,157 @@
+import math
+from typing import List, Optional
+
+from sqlalchemy import and_, case, false, or_
+
+# events are indexed by the cell of a fixed lat/lon grid they fall in (points)
+# or pass through (tornado paths), which stands in for a spatial index and works on any DB
+CELL_SIZE = 0.25
+GRID_COLUMNS = int(360 / CELL_SIZE)
+# past this many cells an IN (...) lookup stops paying off vs. the lat/lon indexes
+MAX_CELLS = 2000
+
+# equirectangular approximation, plenty accurate at the scale of a storm report
+KM_PER_DEGREE = 111.2
+
+
+def grid_cell(lat, lon):
+    # works on scalars and numpy arrays alike; callers cast to int
+    return (lat + 90) // CELL_SIZE * GRID_COLUMNS + (lon + 180) // CELL_SIZE
+
+
+def grid_cells_in_bbox(min_lat, min_lon, max_lat, max_lon, margin=0) -> Optional[List[int]]:
+    min_row, max_row = int((min_lat + 90) // CELL_SIZE) - margin, int((max_lat + 90) // CELL_SIZE) + margin
+    min_col, max_col = int((min_lon + 180) // CELL_SIZE) - margin, int((max_lon + 180) // CELL_SIZE) + margin
+    if (max_row - min_row + 1) * (max_col - min_col + 1) > MAX_CELLS:
+        return None
+    return [row * GRID_COLUMNS + col for row in range(min_row, max_row + 1) for col in range(min_col, max_col + 1)]
+
+
+def _crosses_edges(edges, start_lat, start_lon, end_lat, end_lon):
+    # the path from start to end crosses or touches any of the edges
+    def orientation(a, b, c):
+        return (b[1] - a[1]) * (c[0] - a[0]) - (b[0] - a[0]) * (c[1] - a[1])
+
+    start, end = (start_lat, start_lon), (end_lat, end_lon)
+    return [
+        and_(orientation(start, end, p) * orientation(start, end, q) <= 0,
+             orientation(p, q, start) * orientation(p, q, end) <= 0,
+             # rules out collinear segments that don't overlap
+             or_(start_lat >= min(p[0], q[0]), end_lat >= min(p[0], q[0])),
+             or_(start_lat <= max(p[0], q[0]), end_lat <= max(p[0], q[0])),
+             or_(start_lon >= min(p[1], q[1]), end_lon >= min(p[1], q[1])),
+             or_(start_lon <= max(p[1], q[1]), end_lon <= max(p[1], q[1])))
+        for p, q in edges
+    ]
+
+
+class _Shape:
+    def bbox(self):
+        raise NotImplementedError
+
+    def contains_point(self, lat, lon):
+        raise NotImplementedError
+
+    def touches_path(self, start_lat, start_lon, end_lat, end_lon):
+        raise NotImplementedError
+
+    def grid_cells(self, margin=0) -> Optional[List[int]]:
+        return grid_cells_in_bbox(*self.bbox(), margin=margin)
+
+
+class BBoxShape(_Shape):
+    def __init__(self, min_lat, min_lon, max_lat, max_lon):
+        if min_lat > max_lat or min_lon > max_lon:
+            raise ValueError('Bounding box minimums must not be greater than its maximums!')
+        self._bbox = (min_lat, min_lon, max_lat, max_lon)
+
+    def bbox(self):
+        return self._bbox
+
+    def contains_point(self, lat, lon):
+        min_lat, min_lon, max_lat, max_lon = self._bbox
+        return and_(lat >= min_lat, lat <= max_lat, lon >= min_lon, lon <= max_lon)
+
+    def touches_path(self, start_lat, start_lon, end_lat, end_lon):
+        # the path starts inside the box or crosses one of its sides
+        min_lat, min_lon, max_lat, max_lon = self._bbox
+        corners = [(min_lat, min_lon), (min_lat, max_lon), (max_lat, max_lon), (max_lat, min_lon)]
+        edges = list(zip(corners, corners[1:] + corners[:1]))
+        return or_(self.contains_point(start_lat, start_lon),
+                   *_crosses_edges(edges, start_lat, start_lon, end_lat, end_lon))
+
+
+class RadiusShape(_Shape):
+    def __init__(self, lat, lon, km):
+        if km < 0:
+            raise ValueError('Radius must not be negative!')
+        self._lat, self._lon = lat, lon
+        self._radius = km / KM_PER_DEGREE
+        # longitude degrees shrink towards the poles
+        self._lon_scale = max(math.cos(math.radians(lat)), 0.01)
+
+    def bbox(self):
+        lon_radius = self._radius / self._lon_scale
+        return (self._lat - self._radius, self._lon - lon_radius,
+                self._lat + self._radius, self._lon + lon_radius)
+
+    def _project(self, lat, lon):
+        return (lon - self._lon) * self._lon_scale, lat - self._lat
+
+    def contains_point(self, lat, lon):
+        x, y = self._project(lat, lon)
+        return x * x + y * y <= self._radius ** 2
+
+    def touches_path(self, start_lat, start_lon, end_lat, end_lon):
+        # distance from the center to the closest point of the path
+        ax, ay = self._project(start_lat, start_lon)
+        dx, dy = (end_lon - start_lon) * self._lon_scale, end_lat - start_lat
+        length_sq = dx * dx + dy * dy
+        closest = -(ax * dx + ay * dy) / length_sq
+        t = case((length_sq == 0, 0), (closest < 0, 0), (closest > 1, 1), else_=closest)
+        px, py = ax + t * dx, ay + t * dy
+        return px * px + py * py <= self._radius ** 2
+
+
+class PolygonShape(_Shape):
+    def __init__(self, points):
+        if len(points) < 3 or any(len(point) != 2 for point in points):
+            raise ValueError('Polygon must be a list of at least 3 [lat, lon] points!')
+        self._points = [tuple(point) for point in points]
+        self._edges = list(zip(self._points, self._points[1:] + self._points[:1]))
+
+    def bbox(self):
+        lats, lons = zip(*self._points)
+        return min(lats), min(lons), max(lats), max(lons)
+
+    def contains_point(self, lat, lon):
+        # ray casting: a point is inside if a ray from it crosses the edges an odd number of times
+        crossings = 0
+        for (lat_i, lon_i), (lat_j, lon_j) in self._edges:
+            if lat_i == lat_j:
+                continue
+            crosses = and_(
+                lat >= min(lat_i, lat_j), lat < max(lat_i, lat_j),
+                lon < lon_i + (lon_j - lon_i) / (lat_j - lat_i) * (lat - lat_i)
+            )
+            crossings = crossings + case((crosses, 1), else_=0)
+        if isinstance(crossings, int):
+            # every edge is horizontal, so nothing can be inside
+            return false()
+        return crossings % 2 == 1
+
+    def touches_path(self, start_lat, start_lon, end_lat, end_lon):
+        # the path starts inside the polygon or crosses one of its edges
+        return or_(self.contains_point(start_lat, start_lon),
+                   *_crosses_edges(self._edges, start_lat, start_lon, end_lat, end_lon))
+
+
+def spatial_shapes(filter) -> List[_Shape]:
+    shapes = []
+    if filter.bbox is not None:
+        shapes.append(BBoxShape(filter.bbox.minLat, filter.bbox.minLon, filter.bbox.maxLat, filter.bbox.maxLon))
+    if filter.withinRadius is not None:
+        shapes.append(RadiusShape(filter.withinRadius.lat, filter.withinRadius.lon, filter.withinRadius.km))
+    if filter.polygon is not None:
+        shapes.append(PolygonShape(filter.polygon))
+    return shapes
@@ -0,0 +1,111 @@
+import hashlib
+import json
+from urllib.parse import parse_qs
+
+from decouple import config
+
+from .dataset import dataset_version
+
+
+class HttpCacheConfig:
+    # how long browsers and shared caches may reuse a GET response without revalidating it
+    MAX_AGE = config('HTTP_CACHE_MAX_AGE', default=300, cast=int)
+    # smaller responses aren't worth compressing
+    GZIP_MIN_SIZE = config('HTTP_GZIP_MIN_SIZE', default=1024, cast=int)
+
+
+_PARAMS = ('query', 'variables', 'operationName', 'extensions')
+# encoded parameters, to be decoded as JSON
+_JSON_PARAMS = ('variables', 'extensions')
+
+
+def _error(message):
+    return json.dumps({'errors': [{'message': message}]}).encode()
+
+
+def _request(query_string):
+    # the GET parameters as the JSON body of the equivalent POST
+    params = parse_qs(query_string.decode('latin-1'))
+    data = {}
+    for name in _PARAMS:
+        if name not in params:
+            continue
+        value = params[name][0]
+        data[name] = json.loads(value) if name in _JSON_PARAMS else value
+    return data
+
+
+def _matches(if_none_match, etag):
+    # weak comparison, which is all a weak ETag allows
+    tags = [tag.strip() for tag in if_none_match.split(',')]
+    return '*' in tags or any(tag.removeprefix('W/') == etag.removeprefix('W/') for tag in tags)
+
+
+class HttpCacheMiddleware:
+    """
+    Serves queries over GET (`?query=...&variables=...`, or a persisted query's `extensions`), with an ETag
+    made of the dataset version and a hash of the request. The data only changes when it is reseeded, so
+    a matching `If-None-Match` is answered with a 304 before the request gets anywhere near the DB.
+    Responses with errors aren't cached. POST requests are passed through untouched.
+    """
+
+    def __init__(self, app, path='/graphql'):
+        self._app = app
+        self._path = path
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['method'] != 'GET' or scope['path'].rstrip('/') != self._path:
+            return await self._app(scope, receive, send)
+
+        try:
+            data = _request(scope['query_string'])
+        except ValueError:
+            return await self._respond(send, 400, [], _error('variables and extensions must be JSON'))
+        if 'query' not in data and 'extensions' not in data:
+            # GraphiQL
+            return await self._app(scope, receive, send)
+
+        body = json.dumps(data).encode()
+        request_hash = hashlib.sha256(json.dumps(data, sort_keys=True).encode()).hexdigest()[:32]
+        etag = f'W/"{await dataset_version.current()}-{request_hash}"'
+        cached_headers = [
+            (b'etag', etag.encode()), (b'cache-control', f'public, max-age={HttpCacheConfig.MAX_AGE}'.encode()),
+        ]
+
+        headers = dict(scope['headers'])
+        if_none_match = headers.get(b'if-none-match')
+        if if_none_match is not None and _matches(if_none_match.decode('latin-1'), etag):
+            return await self._respond(send, 304, cached_headers, b'')
+
+        headers.update({b'content-type': b'application/json', b'content-length': str(len(body)).encode()})
+        scope = dict(scope, method='POST', query_string=b'', headers=list(headers.items()))
+
+        async def replay():
+            return {'type': 'http.request', 'body': body, 'more_body': False}
+
+        start = None
+        chunks = []
+
+        async def cache(message):
+            nonlocal start
+            if message['type'] == 'http.response.start':
+                start = message
+                return
+            chunks.append(message.get('body', b''))
+            if message.get('more_body', False):
+                return
+            response = b''.join(chunks)
+            # `"errors":` can't appear inside a JSON string, only as a key
+            cacheable = start['status'] == 200 and b'"errors":' not in response
+            extra_headers = cached_headers if cacheable else [(b'cache-control', b'no-store')]
+            await send(dict(start, headers=list(start.get('headers', [])) + extra_headers))
+            await send({'type': 'http.response.body', 'body': response})
+
+        await self._app(scope, replay, cache)
+
+    @staticmethod
+    async def _respond(send, status, headers, body):
+        if body:
+            headers = [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode()), *headers]
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': body})
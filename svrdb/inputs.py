@@ -1,12 +1,34 @@
 from datetime import datetime
+from enum import Enum
 from typing import List, Optional
 
 import strawberry
 
 
+@strawberry.input
+class BoundingBox:
+    minLat: float
+    minLon: float
+    maxLat: float
+    maxLon: float
+
+
+@strawberry.input
+class Radius:
+    lat: float
+    lon: float
+    km: float
+
+
 @strawberry.interface
 class SpatialFilter:
     states: List[str] = None
+    bbox: Optional[BoundingBox] = None
+    withinRadius: Optional[Radius] = None
+    # [lat, lon] vertices
+    polygon: List[List[float]] = None
+    # 5 digit state + county FIPS codes, e.g. 40109 for Oklahoma County, OK
+    countyFips: List[int] = None
 
 
 @strawberry.interface
@@ -36,5 +58,17 @@ class TornadoFilter(SpatialFilter, TemporalFilter):
 
 @strawberry.input
 class Pagination:
-    offset: Optional[int]
-    limit: Optional[int]
+    offset: Optional[int] = None
+    limit: Optional[int] = None
+    # opaque `cursor` of the last event seen; results resume right after it
+    after: Optional[str] = None
+
+
+@strawberry.enum
+class StatsGroupBy(Enum):
+    YEAR = 'year'
+    MONTH = 'month'
+    HOUR = 'hour'
+    STATE = 'state'
+    # (E)F rating for tornadoes, hail size or wind speed otherwise
+    MAGNITUDE = 'magnitude'
@@ -0,0 +1,139 @@
+import logging
+
+from decouple import config
+from graphql import (
+    FieldNode, FragmentDefinitionNode, FragmentSpreadNode, GraphQLError, InlineFragmentNode, get_named_type,
+    get_nullable_type, get_operation_ast, is_list_type
+)
+from graphql.execution import ExecutionResult
+from graphql.execution.values import get_argument_values, get_variable_values
+from sqlalchemy.exc import SQLAlchemyError
+from strawberry.arguments import convert_arguments
+from strawberry.extensions import Extension
+
+from .fetch import TornadoFetch, HailFetch, WindFetch
+from .replicas import read_async
+
+logger = logging.getLogger(__name__)
+
+
+class QueryCostConfig:
+    MAX_DEPTH = config('QUERY_MAX_DEPTH', default=4, cast=int)
+    # the most objects (events, segments, counties) one request may resolve
+    MAX_COST = config('QUERY_MAX_COST', default=50000, cast=int)
+    # assumed children per parent for nested lists, e.g. segments per tornado
+    LIST_FANOUT = config('QUERY_LIST_FANOUT', default=2, cast=int)
+
+
+# query fields that page through events
+_FETCHES = {
+    'tornado': TornadoFetch,
+    'hail': HailFetch,
+    'wind': WindFetch,
+}
+
+
+def _fields(schema, parent_type, selection_set, fragments):
+    # (parent type, field node) pairs, with fragments flattened into their parent
+    for node in selection_set.selections:
+        if isinstance(node, FieldNode):
+            yield parent_type, node
+        elif isinstance(node, InlineFragmentNode):
+            type_ = parent_type if node.type_condition is None else schema.get_type(node.type_condition.name.value)
+            yield from _fields(schema, type_, node.selection_set, fragments)
+        elif isinstance(node, FragmentSpreadNode) and node.name.value in fragments:
+            fragment = fragments[node.name.value]
+            yield from _fields(schema, schema.get_type(fragment.type_condition.name.value), fragment.selection_set,
+                               fragments)
+
+
+def _object_cost(schema, type_, selection_set, fragments):
+    # the object itself, plus whatever its nested lists fan out to
+    cost = 1
+    for parent_type, node in _fields(schema, type_, selection_set, fragments):
+        if node.selection_set is None:
+            continue
+        field_type = parent_type.fields[node.name.value].type
+        fanout = QueryCostConfig.LIST_FANOUT if is_list_type(get_nullable_type(field_type)) else 1
+        cost += fanout * _object_cost(schema, get_named_type(field_type), node.selection_set, fragments)
+    return cost
+
+
+class QueryCostLimiter(Extension):
+    """
+    Rejects queries estimated to resolve more than `QUERY_MAX_COST` objects before anything is executed.
+    Each event field costs the rows its page will hold times the objects selected per row: the page size
+    bounds it, and only when that bound is over budget is the page counted in the DB (a COUNT that stops
+    at the page size).
+    """
+
+    async def on_executing_start(self):
+        ctx = self.execution_context
+        try:
+            cost = await self._cost()
+        except ValueError as e:
+            ctx.result = ExecutionResult(data=None, errors=[GraphQLError(str(e))])
+            return
+        except SQLAlchemyError:
+            # the estimate's COUNT failed, even after failing over, and the query can't run unchecked
+            logger.exception('estimating the query cost failed')
+            ctx.result = ExecutionResult(data=None, errors=[GraphQLError(
+                'Could not estimate the cost of the query, try again later'
+            )])
+            return
+        if cost > QueryCostConfig.MAX_COST:
+            ctx.result = ExecutionResult(data=None, errors=[GraphQLError(
+                f'Query would resolve an estimated {cost} objects, more than the {QueryCostConfig.MAX_COST} allowed! '
+                f'Narrow the filter or request smaller pages'
+            )])
+
+    def _event_fields(self):
+        ctx = self.execution_context
+        schema, strawberry_schema = ctx.schema._schema, ctx.schema
+        operation = get_operation_ast(ctx.graphql_document, ctx.operation_name)
+        if operation is None or operation.operation.value != 'query':
+            return
+        variables = get_variable_values(schema, operation.variable_definitions or [], ctx.variables or {})
+        if isinstance(variables, list):
+            # invalid variables, which execution reports
+            return
+
+        fragments = {
+            definition.name.value: definition for definition in ctx.graphql_document.definitions
+            if isinstance(definition, FragmentDefinitionNode)
+        }
+        strawberry_fields = {
+            strawberry_schema.config.name_converter.from_field(field): field
+            for field in strawberry_schema.query.definition.fields
+        }
+        for parent_type, node in _fields(schema, schema.query_type, operation.selection_set, fragments):
+            name = node.name.value
+            if name not in _FETCHES:
+                continue
+            field_def = parent_type.fields[name]
+            kwargs = convert_arguments(
+                get_argument_values(field_def, node, variables), strawberry_fields[name].arguments,
+                scalar_registry=strawberry_schema.schema_converter.scalar_registry, config=strawberry_schema.config
+            )
+            yield _FETCHES[name], kwargs, _object_cost(schema, get_named_type(field_def.type), node.selection_set,
+                                                       fragments)
+
+    async def _cost(self):
+        events = []
+        for fetch_cls, kwargs, object_cost in self._event_fields():
+            limit, _offset = fetch_cls(session=None).limit_and_offset(kwargs.get('pagination'))
+            events.append((fetch_cls, kwargs, object_cost, limit))
+
+        # most queries are under budget even if every page comes back full
+        cost = sum(object_cost * limit for _fetch_cls, _kwargs, object_cost, limit in events)
+        if cost <= QueryCostConfig.MAX_COST:
+            return cost
+
+        async def count(session):
+            cost = 0
+            for fetch_cls, kwargs, object_cost, _limit in events:
+                rows = await fetch_cls(session).count_async(kwargs.get('filter'), 'datetime', kwargs.get('pagination'))
+                cost += object_cost * rows
+            return cost
+
+        return await read_async(count)
@@ -0,0 +1,51 @@
+from collections import defaultdict
+from typing import List
+
+from sqlalchemy import select
+
+from .models import TornadoSegment, TornadoSegmentCounty
+from .replicas import read_async
+
+
+async def _all(statement):
+    async def read(session):
+        return (await session.execute(statement)).all()
+
+    return await read_async(read)
+
+
+async def load_segments(tornado_ids: List[int]):
+    """
+    The segments of each of `tornado_ids`, in the same order, loaded in one `IN (...)` query of plain
+    rows and grouped by tornado in one pass. They aren't cached on their own: the page of tornadoes
+    they were loaded for is, segments included.
+    """
+    if not tornado_ids:
+        return []
+    segments = defaultdict(list)
+    queried = await _all(
+        select(*TornadoSegment.__table__.columns)
+        .where(TornadoSegment.tornado_id.in_(tornado_ids))
+        .order_by(TornadoSegment.id)
+    )
+    for segment in queried:
+        segments[segment.tornado_id].append(segment)
+    return [segments[tornado_id] for tornado_id in tornado_ids]
+
+
+async def load_segment_counties(segment_ids: List[int]):
+    """
+    The county rows of each of `segment_ids`, like `load_segments`; the counties themselves
+    come from the process-wide county cache.
+    """
+    if not segment_ids:
+        return []
+    segment_counties = defaultdict(list)
+    queried = await _all(
+        select(*TornadoSegmentCounty.__table__.columns)
+        .where(TornadoSegmentCounty.tornado_segment_id.in_(segment_ids))
+        .order_by(TornadoSegmentCounty.county_order)
+    )
+    for segment_county in queried:
+        segment_counties[segment_county.tornado_segment_id].append(segment_county)
+    return [segment_counties[segment_id] for segment_id in segment_ids]
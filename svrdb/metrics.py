@@ -0,0 +1,162 @@
+import logging
+import random
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from inspect import isawaitable
+from threading import Lock
+from typing import Sequence
+
+from decouple import config
+from sqlalchemy import event
+from strawberry.extensions import Extension
+
+logger = logging.getLogger(__name__)
+
+
+class MetricsConfig:
+    # statements running longer than this go to the slow query log, 0 makes every statement a candidate
+    SLOW_QUERY_MS = config('SLOW_QUERY_MS', default=250, cast=float)
+    # the share of those candidates actually logged
+    SLOW_QUERY_SAMPLE_RATE = config('SLOW_QUERY_SAMPLE_RATE', default=1.0, cast=float)
+
+
+_SECONDS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+_ROWS = (0, 1, 10, 100, 500, 1000, 5000, 10000)
+
+_registry = []
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _labels(pairs):
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}' if pairs else ''
+
+
+class Histogram:
+    """
+    A Prometheus histogram, kept in process: every series counts its observations per bucket,
+    and is rendered in the text exposition format with cumulative buckets.
+    """
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (), buckets: Sequence[float] = _SECONDS):
+        self._name = name
+        self._documentation = documentation
+        self._labels = tuple(labels)
+        self._buckets = tuple(buckets)
+        # label values -> [observations per bucket (the last one is +Inf), sum]
+        self._series = {}
+        self._lock = Lock()
+        _registry.append(self)
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels[label] for label in self._labels)
+        with self._lock:
+            counts, total = self._series.get(key) or ([0] * (len(self._buckets) + 1), 0)
+            counts[bisect_left(self._buckets, value)] += 1
+            self._series[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self):
+        lines = [f'# HELP {self._name} {self._documentation}', f'# TYPE {self._name} histogram']
+        with self._lock:
+            series = sorted(self._series.items())
+        for key, (counts, total) in series:
+            pairs = list(zip(self._labels, key))
+            cumulative = 0
+            for bound, count in zip(self._buckets + ('+Inf',), counts):
+                cumulative += count
+                lines.append(f'{self._name}_bucket{_labels(pairs + [("le", bound)])} {cumulative}')
+            lines.append(f'{self._name}_sum{_labels(pairs)} {total}')
+            lines.append(f'{self._name}_count{_labels(pairs)} {cumulative}')
+        return '\n'.join(lines)
+
+
+def render_metrics():
+    return '\n'.join(metric.render() for metric in _registry) + '\n'
+
+
+GRAPHQL_PHASE = Histogram('svrdb_graphql_phase_seconds',
+                          'Time spent parsing, validating and executing GraphQL requests', ['phase'])
+RESOLVER = Histogram('svrdb_resolver_seconds', 'Time spent resolving each query field', ['field'])
+FETCH = Histogram('svrdb_fetch_seconds', 'Time spent executing statements and loading their rows',
+                  ['table', 'phase'])
+FETCH_ROWS = Histogram('svrdb_fetch_rows', 'Rows returned per page of events', ['table'], buckets=_ROWS)
+POOL_WAIT = Histogram('svrdb_pool_wait_seconds', 'Time spent checking a connection out of the pool')
+MARSHAL = Histogram('svrdb_marshal_seconds', 'Time spent turning rows into GraphQL types', ['type'])
+
+
+class GraphQLMetrics(Extension):
+    """
+    Times the parse, validation and execution of every request, and how long each query field
+    took to resolve. Nested fields are left alone, there are (rows times selected fields) of them.
+    """
+
+    def __init__(self, *, execution_context):
+        super().__init__(execution_context=execution_context)
+        self._started = {}
+
+    def _start(self, phase):
+        self._started[phase] = time.perf_counter()
+
+    def _end(self, phase):
+        GRAPHQL_PHASE.observe(time.perf_counter() - self._started.pop(phase), phase=phase)
+
+    def on_parsing_start(self):
+        self._start('parse')
+
+    def on_parsing_end(self):
+        self._end('parse')
+
+    def on_validation_start(self):
+        self._start('validate')
+
+    def on_validation_end(self):
+        self._end('validate')
+
+    def on_executing_start(self):
+        self._start('execute')
+
+    def on_executing_end(self):
+        self._end('execute')
+
+    def resolve(self, _next, root, info, *args, **kwargs):
+        result = _next(root, info, *args, **kwargs)
+        if info.path.prev is not None or not isawaitable(result):
+            return result
+        return self._timed(result, info.field_name)
+
+    @staticmethod
+    async def _timed(result, field):
+        with RESOLVER.time(field=field):
+            return await result
+
+
+def _before_cursor_execute(_conn, _cursor, _statement, _parameters, context, _executemany):
+    context.svrdb_started = time.perf_counter()
+
+
+def _after_cursor_execute(_conn, _cursor, statement, parameters, context, _executemany):
+    elapsed_ms = (time.perf_counter() - context.svrdb_started) * 1000
+    if elapsed_ms < MetricsConfig.SLOW_QUERY_MS or random.random() >= MetricsConfig.SLOW_QUERY_SAMPLE_RATE:
+        return
+    logger.warning('slow query (%.1f ms) for filter %r: %s %r', elapsed_ms,
+                   context.execution_options.get('svrdb_filter'), statement, parameters)
+
+
+def log_slow_queries(engine):
+    """
+    Logs a sample of the statements `engine` runs for longer than `SLOW_QUERY_MS`, along with the
+    filter a `_ModelFetch` built them from (passed as the `svrdb_filter` execution option).
+    """
+    event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
@@ -2,12 +2,16 @@ from datetime import datetime
 
 from sqlalchemy import (
     Column, Integer, String, DateTime, Float, ForeignKey, create_engine, Numeric,
-    Boolean
+    Boolean, Index, event
 )
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship, Session, declarative_mixin, declared_attr
 from decouple import config
 
+from .metrics import log_slow_queries
+
 
 class DBConfig:
     DRIVER = config('MYSQL_DRIVER', default='pymysql')
@@ -16,26 +20,82 @@ class DBConfig:
     PASSWORD = config('MYSQL_PASSWORD', default='pw')
     DB = config('MYSQL_DATABASE', default='db')
     PORT = config('MYSQL_PORT', default=3306, cast=int)
+    ASYNC_DRIVER = config('MYSQL_ASYNC_DRIVER', default='aiomysql')
+
+    # logs every statement, see SLOW_QUERY_MS for a sampled log of the slow ones
+    ECHO = config('DB_ECHO', default=False, cast=bool)
+    POOL_SIZE = config('DB_POOL_SIZE', default=5, cast=int)
+    MAX_OVERFLOW = config('DB_MAX_OVERFLOW', default=10, cast=int)
+    # MySQL drops connections idle for longer than wait_timeout (8 hours by default)
+    POOL_RECYCLE = config('DB_POOL_RECYCLE', default=3600, cast=int)
+    POOL_PRE_PING = config('DB_POOL_PRE_PING', default=True, cast=bool)
+
+    # serve from a read-only SQLite file built by the seeder (see seeding/embedded.py) instead of MySQL
+    EMBEDDED_FILE = config('DB_EMBEDDED_FILE', default=None)
+    EMBEDDED_MMAP_SIZE = config('DB_EMBEDDED_MMAP_SIZE', default=2 ** 30, cast=int)
 
     @classmethod
     def mysql_conn_str(cls):
+        if cls.EMBEDDED_FILE:
+            return f'sqlite:///file:{cls.EMBEDDED_FILE}?mode=ro&uri=true'
         db_url_override = config('DATABASE_URL', default=None)
         if db_url_override:
             return db_url_override
         return f'mysql+{cls.DRIVER}://{cls.USER}:{cls.PASSWORD}@{cls.HOST}:{cls.PORT}/{cls.DB}'
 
+    @classmethod
+    def async_conn_str(cls, url=None):
+        url = make_url(url or cls.mysql_conn_str())
+        if url.get_backend_name() == 'sqlite':
+            return str(url.set(drivername='sqlite+aiosqlite'))
+        return str(url.set(drivername=f'{url.get_backend_name()}+{cls.ASYNC_DRIVER}'))
+
+    @classmethod
+    def engine_kwargs(cls, url):
+        kwargs = dict(echo=cls.ECHO, pool_recycle=cls.POOL_RECYCLE, pool_pre_ping=cls.POOL_PRE_PING)
+        # sqlite doesn't pool connections, so it doesn't take pool sizes
+        if make_url(url).get_backend_name() != 'sqlite':
+            kwargs |= dict(pool_size=cls.POOL_SIZE, max_overflow=cls.MAX_OVERFLOW)
+        return kwargs
+
 
 class Tables:
     TORNADO = 'tornado'
     TORNADO_SEGMENT = 'tornado_segment'
     TORNADO_SEGMENT_COUNTY = 'tornado_segment_county'
+    TORNADO_GRID_CELL = 'tornado_grid_cell'
+    TORNADO_LOCATION = 'tornado_location'
+    DATASET_VERSION = 'dataset_version'
+    SEED_FINGERPRINT = 'seed_fingerprint'
+    TORNADO_ROLLUP = 'tornado_rollup'
+    HAIL_ROLLUP = 'hail_rollup'
+    WIND_ROLLUP = 'wind_rollup'
     COUNTY = 'county'
     HAIL = 'hail'
     WIND = 'wind'
 
 
 db_url = DBConfig.mysql_conn_str()
-engine = create_engine(db_url, echo=True, future=True)
+engine = create_engine(db_url, future=True, **DBConfig.engine_kwargs(db_url))
+
+async_db_url = DBConfig.async_conn_str()
+async_engine = create_async_engine(async_db_url, **DBConfig.engine_kwargs(async_db_url))
+
+
+def _embedded_pragmas(dbapi_connection, _connection_record):
+    # reads go through the OS page cache, which every process serving the same file shares
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f'PRAGMA mmap_size={DBConfig.EMBEDDED_MMAP_SIZE}')
+    cursor.execute('PRAGMA query_only=1')
+    cursor.close()
+
+
+if DBConfig.EMBEDDED_FILE:
+    event.listen(engine, 'connect', _embedded_pragmas)
+    event.listen(async_engine.sync_engine, 'connect', _embedded_pragmas)
+
+# only the API's statements, seeding bulk inserts are slow by design
+log_slow_queries(async_engine.sync_engine)
 
 Base = declarative_base()
 
@@ -44,10 +104,19 @@ def get_session():
     return Session(bind=engine, future=True)
 
 
+def get_async_session():
+    return AsyncSession(bind=async_engine)
+
+
 @declarative_mixin
 class _Event:
     id: int = Column(Integer, primary_key=True)
     datetime: datetime = Column(DateTime, index=True, nullable=False)
+    # denormalized parts of `datetime` for cross-year filters like "every May"
+    year: int = Column(Integer, index=True, nullable=False)
+    month: int = Column(Integer, index=True, nullable=False)
+    day: int = Column(Integer, index=True, nullable=False)
+    hour: int = Column(Integer, index=True, nullable=False)
     state: str = Column(String(255), index=True, nullable=False)
     fatalities: int = Column(Integer, nullable=False)
     injuries: int = Column(Integer, nullable=False)
@@ -56,6 +125,11 @@ class _Event:
     closs: float = Column(Float, nullable=False)
     country: str = Column(String(255), index=True, nullable=False, default='US')
 
+    @declared_attr
+    def __table_args__(cls):
+        # backs keyset pagination, which seeks and orders on (datetime, id)
+        return (Index(f'ix_{cls.__tablename__}_datetime_id', 'datetime', 'id'),)
+
 
 class County(Base):
     __tablename__ = Tables.COUNTY
@@ -70,11 +144,13 @@ class County(Base):
 class _PointEvent(_Event):
     lat: float = Column(Numeric(4, 2), nullable=False, index=True)
     lon: float = Column(Numeric(5, 2), nullable=False, index=True)
+    # see svrdb.geo
+    grid_cell: int = Column(Integer, nullable=False, index=True)
 
     @declared_attr
     def county_id(cls) -> int:
         # a lot of records have missing county data
-        return Column(Integer, ForeignKey(f'{County.__tablename__}.id'), nullable=True)
+        return Column(Integer, ForeignKey(f'{County.__tablename__}.id'), nullable=True, index=True)
 
     @declared_attr
     def county(cls) -> County:
@@ -114,14 +190,85 @@ class TornadoSegment(Base, _PathEvent):
     magnitude: float = Column(Integer, nullable=True, index=True)
     magnitude_unk: bool = Column(Boolean, nullable=False)
 
-    tornado_id: int = Column(Integer, ForeignKey(f'{Tornado.__tablename__}.id'), nullable=False)
+    tornado_id: int = Column(Integer, ForeignKey(f'{Tornado.__tablename__}.id'), nullable=False, index=True)
     counties = relationship('TornadoSegmentCounty')
 
 
 class TornadoSegmentCounty(Base):
     __tablename__ = Tables.TORNADO_SEGMENT_COUNTY
     id: int = Column(Integer, primary_key=True)
-    tornado_segment_id: int = Column(ForeignKey(f'{TornadoSegment.__tablename__}.id'), nullable=False)
+    tornado_segment_id: int = Column(ForeignKey(f'{TornadoSegment.__tablename__}.id'), nullable=False, index=True)
     county_id: int = Column(ForeignKey(f'{County.__tablename__}.id'), nullable=False)
     county_order: int = Column(Integer, nullable=False)
     county: County = relationship('County')
+
+
+class TornadoGridCell(Base):
+    # every grid cell (see svrdb.geo) a tornado's path passes through, in lookup order
+    __tablename__ = Tables.TORNADO_GRID_CELL
+    cell: int = Column(Integer, primary_key=True)
+    tornado_id: int = Column(Integer, ForeignKey(f'{Tornado.__tablename__}.id'), primary_key=True)
+
+
+class TornadoLocation(Base):
+    # every state and county any segment of a tornado touches, so tornadoes can be looked up by either
+    # through an index instead of going through the segments
+    __tablename__ = Tables.TORNADO_LOCATION
+    id: int = Column(Integer, primary_key=True)
+    tornado_id: int = Column(Integer, ForeignKey(f'{Tornado.__tablename__}.id'), nullable=False)
+    state: str = Column(String(255), nullable=False)
+    # null on the per-state rows
+    county_id: int = Column(Integer, ForeignKey(f'{County.__tablename__}.id'), nullable=True)
+    # the tornado's
+    datetime: datetime = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        Index('ix_tornado_location_state', 'state', 'datetime', 'tornado_id'),
+        Index('ix_tornado_location_county_id', 'county_id', 'datetime', 'tornado_id'),
+    )
+
+
+class DatasetVersion(Base):
+    # single row, bumped by every seed so caches know when the data changed
+    __tablename__ = Tables.DATASET_VERSION
+    id: int = Column(Integer, primary_key=True)
+    version: str = Column(String(255), nullable=False)
+    seeded_at: datetime = Column(DateTime, nullable=False)
+
+
+class SeedFingerprint(Base):
+    # hash of every year of source data as of the last seed, so incremental seeds only reload what changed
+    __tablename__ = Tables.SEED_FINGERPRINT
+    dataset: str = Column(String(255), primary_key=True)
+    year: int = Column(Integer, primary_key=True)
+    fingerprint: str = Column(String(64), nullable=False)
+
+
+@declarative_mixin
+class _Rollup:
+    # event totals per (year, month, state, magnitude), rebuilt by every seed (see seeding/rollups.py)
+    id: int = Column(Integer, primary_key=True)
+    year: int = Column(Integer, index=True, nullable=False)
+    month: int = Column(Integer, nullable=False)
+    state: str = Column(String(255), index=True, nullable=False)
+    count: int = Column(Integer, nullable=False)
+    fatalities: int = Column(Integer, nullable=False)
+    injuries: int = Column(Integer, nullable=False)
+    loss: float = Column(Float, nullable=False)
+    closs: float = Column(Float, nullable=False)
+
+
+class TornadoRollup(Base, _Rollup):
+    __tablename__ = Tables.TORNADO_ROLLUP
+    magnitude: float = Column(Integer, nullable=True, index=True)
+    length: float = Column(Numeric(12, 2), nullable=False)
+
+
+class HailRollup(Base, _Rollup):
+    __tablename__ = Tables.HAIL_ROLLUP
+    magnitude: float = Column(Numeric(4, 2), nullable=False, index=True)
+
+
+class WindRollup(Base, _Rollup):
+    __tablename__ = Tables.WIND_ROLLUP
+    magnitude: int = Column(Integer, nullable=False, index=True)
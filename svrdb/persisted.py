@@ -0,0 +1,111 @@
+import hashlib
+import json
+
+from decouple import config
+from graphql import GraphQLError
+from strawberry.extensions import ParserCache
+
+from .cache import LRUBackend, RedisBackend, CacheConfig, MISSING
+
+
+class PersistedQueryConfig:
+    SIZE = config('PERSISTED_QUERY_CACHE_SIZE', default=1000, cast=int)
+    TTL = config('PERSISTED_QUERY_TTL', default=30 * 24 * 3600, cast=int)
+
+
+_NOT_FOUND = json.dumps({
+    'errors': [{'message': 'PersistedQueryNotFound', 'extensions': {'code': 'PERSISTED_QUERY_NOT_FOUND'}}]
+}).encode()
+
+
+def _error(message):
+    return json.dumps({'errors': [{'message': message}]}).encode()
+
+
+class QueryParserCache(ParserCache):
+    def on_parsing_start(self):
+        # the hook runs outside of the executor's error handling, so leave syntax errors
+        # for its own (uncached) parse to report
+        try:
+            super().on_parsing_start()
+        except GraphQLError:
+            pass
+
+
+class PersistedQueryMiddleware:
+    """
+    Automatic persisted queries (the Apollo protocol): clients send `extensions.persistedQuery.sha256Hash`
+    instead of the query text, and only send the text along after a `PersistedQueryNotFound`, which
+    registers it under that hash. Queries are kept in the response cache's backend (Redis when shared).
+    """
+
+    def __init__(self, app, path='/graphql'):
+        self._app = app
+        self._path = path
+        self._queries = (
+            RedisBackend(CacheConfig.URL, PersistedQueryConfig.TTL) if CacheConfig.URL
+            else LRUBackend(PersistedQueryConfig.SIZE, PersistedQueryConfig.TTL)
+        )
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['method'] != 'POST' or scope['path'].rstrip('/') != self._path:
+            return await self._app(scope, receive, send)
+
+        body = b''
+        more_body = True
+        while more_body:
+            message = await receive()
+            body += message.get('body', b'')
+            more_body = message.get('more_body', False)
+
+        try:
+            data = json.loads(body)
+            persisted = data.get('extensions', {}).get('persistedQuery')
+        except (ValueError, AttributeError):
+            # not ours to judge, the GraphQL router answers malformed requests
+            persisted = None
+
+        if persisted is not None:
+            body, error = await self._resolve(data, persisted)
+            if error is not None:
+                return await self._respond(send, error)
+
+        replayed = False
+
+        async def replay():
+            nonlocal replayed
+            if replayed:
+                return await receive()
+            replayed = True
+            return {'type': 'http.request', 'body': body, 'more_body': False}
+
+        await self._app(scope, replay, send)
+
+    async def _resolve(self, data, persisted):
+        query_hash = persisted.get('sha256Hash') if isinstance(persisted, dict) else None
+        if not isinstance(query_hash, str):
+            return None, _error('persistedQuery needs a sha256Hash')
+        key = f'svrdb:apq:{query_hash}'
+
+        query = data.get('query')
+        if query is None:
+            query = await self._queries.get(key)
+            if query is MISSING:
+                return None, _NOT_FOUND
+            data['query'] = query
+        elif not isinstance(query, str):
+            return None, _error('query must be a string')
+        elif hashlib.sha256(query.encode()).hexdigest() != query_hash:
+            return None, _error('provided sha256Hash does not match query')
+        else:
+            await self._queries.set(key, query)
+        return json.dumps(data).encode(), None
+
+    @staticmethod
+    async def _respond(send, body):
+        # GraphQL errors go out as a 200, like the router's own
+        await send({
+            'type': 'http.response.start', 'status': 200,
+            'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())],
+        })
+        await send({'type': 'http.response.body', 'body': body})
@@ -0,0 +1,214 @@
+import asyncio
+import itertools
+import logging
+import math
+import time
+from contextlib import contextmanager
+from threading import Lock
+from typing import Any, Awaitable, Callable
+
+from decouple import Csv, config
+from sqlalchemy import create_engine, event, select, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import DBAPIError, OperationalError
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import Session
+
+from .dataset import dataset_version
+from .metrics import log_slow_queries
+from .models import DBConfig, DatasetVersion, async_engine, engine
+
+logger = logging.getLogger(__name__)
+
+
+class ReplicaConfig:
+    # comma separated URLs of read replicas, the API's reads are spread over them instead of going to the primary
+    URLS = config('DB_REPLICA_URLS', default='', cast=Csv())
+    # round_robin or least_connections
+    STRATEGY = config('DB_REPLICA_STRATEGY', default='round_robin')
+    # how often replicas are checked, and how long one that failed is left out
+    CHECK_INTERVAL = config('DB_REPLICA_CHECK_INTERVAL', default=10, cast=float)
+    # replicas further behind the primary than this many seconds are left out, 0 doesn't check
+    MAX_LAG = config('DB_REPLICA_MAX_LAG', default=0, cast=float)
+
+
+def _is_down(e: DBAPIError):
+    # connection trouble rather than a bad statement
+    return e.connection_invalidated or isinstance(e, OperationalError)
+
+
+class _Replica:
+    def __init__(self, url):
+        self.name = repr(make_url(url))
+        self._url = url
+        async_url = DBConfig.async_conn_str(url)
+        self.async_engine = create_async_engine(async_url, **DBConfig.engine_kwargs(async_url))
+        self._engine = None
+        self._engine_lock = Lock()
+        self.in_use = 0
+        self.down_until = 0.0
+        self.lag = 0.0
+
+        self._count_connections(self.async_engine.sync_engine)
+        log_slow_queries(self.async_engine.sync_engine)
+
+    @property
+    def engine(self):
+        # only exports read through a sync engine, so it's created on their first use
+        with self._engine_lock:
+            if self._engine is None:
+                self._engine = create_engine(self._url, future=True, **DBConfig.engine_kwargs(self._url))
+                self._count_connections(self._engine)
+        return self._engine
+
+    def _count_connections(self, sync_engine):
+        event.listen(sync_engine, 'checkout', self._checkout)
+        event.listen(sync_engine, 'checkin', self._checkin)
+
+    def _checkout(self, *_args):
+        self.in_use += 1
+
+    def _checkin(self, *_args):
+        self.in_use -= 1
+
+    def mark_down(self, reason):
+        if self.down_until <= time.monotonic():
+            logger.warning('replica %s is down, failing over: %s', self.name, reason)
+        self.down_until = time.monotonic() + ReplicaConfig.CHECK_INTERVAL
+
+    def healthy(self, now):
+        return self.down_until <= now and (not ReplicaConfig.MAX_LAG or self.lag <= ReplicaConfig.MAX_LAG)
+
+
+async def _lag(conn):
+    # seconds the replica is behind the primary
+    if conn.dialect.name == 'mysql':
+        try:
+            status = (await conn.execute(text('SHOW REPLICA STATUS'))).mappings().first()
+        except DBAPIError:
+            # before MySQL 8.0.22
+            status = (await conn.execute(text('SHOW SLAVE STATUS'))).mappings().first()
+        if status is None:
+            # not replicating, so not behind either
+            return 0.0
+        lag = status.get('Seconds_Behind_Source', status.get('Seconds_Behind_Master'))
+        # null while replication is stopped
+        return math.inf if lag is None else float(lag)
+
+    # copies of the primary's file, which are only behind if they hold another seed's data
+    version = (await conn.execute(select(DatasetVersion.version))).scalar()
+    return 0.0 if version == await dataset_version.current() else math.inf
+
+
+class ReplicaRouter:
+    """
+    Picks the replica each read goes to, round-robin or whichever has the fewest connections checked
+    out, among the healthy ones. A replica goes down for `CHECK_INTERVAL` seconds when a connection to it
+    fails, and the read is retried on the next one; when all of them are down (or lagging) reads go to
+    the primary.
+    """
+
+    def __init__(self, urls, strategy):
+        if strategy not in ('round_robin', 'least_connections'):
+            raise ValueError(f'Unknown replica strategy: {strategy}')
+        self._replicas = [_Replica(url) for url in urls]
+        self._strategy = strategy
+        self._turn = itertools.count()
+        self._checks = None
+
+    def _pick(self):
+        now = time.monotonic()
+        start = next(self._turn) % len(self._replicas) if self._replicas else 0
+        # rotated, so that ties go round-robin too
+        healthy = [replica for replica in self._replicas[start:] + self._replicas[:start] if replica.healthy(now)]
+        if not healthy:
+            return None
+        if self._strategy == 'least_connections':
+            return min(healthy, key=lambda replica: replica.in_use)
+        return healthy[0]
+
+    @staticmethod
+    def _fails_over(replica, e):
+        if replica is None or not _is_down(e):
+            return False
+        replica.mark_down(e)
+        return True
+
+    async def read_async(self, read: Callable[[AsyncSession], Awaitable[Any]]):
+        # every replica that fails goes down, so this ends up on the primary if need be
+        for attempt in range(len(self._replicas) + 1):
+            replica = self._pick()
+            try:
+                return await self._read_async(replica, read)
+            except DBAPIError as e:
+                if attempt == len(self._replicas) or not self._fails_over(replica, e):
+                    raise
+
+    @staticmethod
+    async def _read_async(replica, read):
+        async with AsyncSession(bind=async_engine if replica is None else replica.async_engine) as session:
+            return await read(session)
+
+    def _execute(self, statement):
+        # like `read_async`
+        for attempt in range(len(self._replicas) + 1):
+            replica = self._pick()
+            session = Session(bind=engine if replica is None else replica.engine, future=True)
+            try:
+                return session, session.execute(statement)
+            except DBAPIError as e:
+                session.close()
+                if attempt == len(self._replicas) or not self._fails_over(replica, e):
+                    raise
+
+    @contextmanager
+    def stream(self, statement):
+        # only running the statement is retried, rows can't be taken back once they've been streamed
+        session, result = self._execute(statement)
+        try:
+            yield result
+        finally:
+            session.close()
+
+    async def check(self):
+        for replica in self._replicas:
+            try:
+                async with replica.async_engine.connect() as conn:
+                    lag = await _lag(conn) if ReplicaConfig.MAX_LAG else 0.0
+            except DBAPIError as e:
+                replica.mark_down(e)
+                continue
+            if ReplicaConfig.MAX_LAG and lag > ReplicaConfig.MAX_LAG >= replica.lag:
+                logger.warning('replica %s is behind the primary (%s seconds), leaving it out', replica.name, lag)
+            replica.lag, replica.down_until = lag, 0.0
+
+    async def _check_periodically(self):
+        while True:
+            try:
+                await self.check()
+            except Exception:
+                logger.exception('checking replicas failed')
+            await asyncio.sleep(ReplicaConfig.CHECK_INTERVAL)
+
+    def start_checks(self):
+        # needs a running event loop, so this is up to the app
+        if self._replicas:
+            self._checks = asyncio.get_running_loop().create_task(self._check_periodically())
+
+
+replicas = ReplicaRouter(ReplicaConfig.URLS, ReplicaConfig.STRATEGY)
+
+
+async def read_async(read: Callable[[AsyncSession], Awaitable[Any]]):
+    """
+    Returns what `read(session)` does with a session on a replica (or the primary without any). If that
+    replica turns out to be down, `read` runs again on the next one, so it should only read.
+    """
+    return await replicas.read_async(read)
+
+
+def stream(statement):
+    """
+    A context manager for the result of `statement` run on a replica (or the primary), like `read_async`.
+    """
+    return replicas.stream(statement)
@@ -0,0 +1,55 @@
+import re
+from typing import Dict, Iterator
+
+from strawberry.types import Info
+from strawberry.types.nodes import FragmentSpread, InlineFragment
+
+_CAMEL_BOUNDARY = re.compile(r'(?<!^)(?=[A-Z])')
+
+
+def _to_snake_case(name: str) -> str:
+    return _CAMEL_BOUNDARY.sub('_', name).lower()
+
+
+class Selection:
+    """
+    Tree of the (snake-cased) field names a client requested under a GraphQL field.
+    Fragments are flattened into their parent, so `'counties' in selection`
+    answers whether the client wants counties regardless of how it asked for them.
+    """
+
+    def __init__(self, children: Dict[str, 'Selection'] = None):
+        self._children = children or {}
+
+    @classmethod
+    def from_info(cls, info: Info) -> 'Selection':
+        ret = cls()
+        for field in info.selected_fields:
+            ret._merge(cls._from_nodes(field.selections))
+        return ret
+
+    @classmethod
+    def _from_nodes(cls, nodes) -> 'Selection':
+        ret = cls()
+        for node in nodes:
+            if isinstance(node, (FragmentSpread, InlineFragment)):
+                ret._merge(cls._from_nodes(node.selections))
+            else:
+                ret._merge(cls({_to_snake_case(node.name): cls._from_nodes(node.selections)}))
+        return ret
+
+    def _merge(self, other: 'Selection'):
+        for name, child in other._children.items():
+            if name in self._children:
+                self._children[name]._merge(child)
+            else:
+                self._children[name] = child
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._children
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._children)
+
+    def __getitem__(self, name: str) -> 'Selection':
+        return self._children.get(name, Selection())
@@ -1,11 +1,31 @@
+import dataclasses
 from datetime import datetime
-from typing import List
+from functools import lru_cache
+from typing import List, Optional
 
 import strawberry
+from strawberry.types import Info
 
+from .cache import response_cache
+from .counties import county_cache
+from .cursor import encode_cursor
 from .fetch import TornadoFetch, HailFetch, WindFetch
-from .inputs import HailFilter, TornadoFilter, WindFilter, Pagination
-from .models import get_session
+from .inputs import HailFilter, TornadoFilter, WindFilter, Pagination, StatsGroupBy
+from .loaders import load_segment_counties, load_segments
+from .metrics import MARSHAL
+from .replicas import read_async
+from .selection import Selection
+
+
+def _pick(model, selection, *fields):
+    return {field: getattr(model, field) for field in fields if field in selection}
+
+
+@lru_cache(maxsize=None)
+def _unselected(cls):
+    # fields the client did not ask for are never resolved, so they are left empty
+    # (and never loaded from the DB)
+    return dict.fromkeys(field.name for field in dataclasses.fields(cls) if field.init)
 
 
 @strawberry.type
@@ -37,36 +57,50 @@ class _Event:
     loss: float
     closs: float
 
+    @strawberry.field
+    def cursor(self) -> str:
+        return encode_cursor(self.datetime, self.id)
+
     @classmethod
-    def _to_dict(cls, model):
-        return dict(
-            id=model.id,
-            datetime=model.datetime,
-            state=model.state,
-            fatalities=model.fatalities,
-            injuries=model.injuries,
-            loss=model.loss,
-            closs=model.closs
-        )
+    def _to_dict(cls, model, selection):
+        # the primary key is always loaded, and nested resolvers look up their children by it
+        ret = dict(id=model.id) | _pick(model, selection, 'datetime', 'state', 'fatalities', 'injuries', 'loss',
+                                        'closs')
+        if 'cursor' in selection:
+            ret['datetime'] = model.datetime
+        return ret
+
+    @classmethod
+    def marshal(cls, model, selection):
+        return cls(**_unselected(cls) | cls._to_dict(model, selection))
 
     @classmethod
-    def marshal(cls, model):
-        return cls(**cls._to_dict(model))
+    def from_rows(cls, rows):
+        # a page's rows hold just the selected columns, named after the fields they fill, so they become the
+        # instances' attributes as is, without building a dict per field and keyword arguments per row
+        keys = rows[0]._fields if rows else ()
+        unselected = _unselected(cls)
+        events = []
+        for row in rows:
+            event = object.__new__(cls)
+            event.__dict__ = unselected.copy()
+            event.__dict__.update(zip(keys, row))
+            events.append(event)
+        return events
 
 
 @strawberry.interface
 class _PointEvent(_Event):
     lat: float
     lon: float
-    county: County
+    county_id: strawberry.Private[Optional[int]]
 
-    @classmethod
-    def _to_dict(cls, model):
-        return super(_PointEvent, cls)._to_dict(model) | dict(
-            lat=model.lat,
-            lon=model.lon,
-            county=County.marshal(model.county, 1)
-        )
+    @strawberry.field
+    def county(self) -> Optional[County]:
+        # a lot of records have missing county data, and a reseed can leave ids the cache doesn't have
+        # yet (until the dataset version is next checked)
+        county = None if self.county_id is None else county_cache.get(self.county_id)
+        return None if county is None else County.marshal(county, 1)
 
 
 @strawberry.interface
@@ -79,14 +113,9 @@ class _PathEvent(_Event):
     end_lon: float
 
     @classmethod
-    def _to_dict(cls, model):
-        return super(_PathEvent, cls)._to_dict(model) | dict(
-            length=model.length,
-            width=model.width,
-            start_lat=model.start_lat,
-            start_lon=model.start_lon,
-            end_lat=model.end_lat,
-            end_lon=model.end_lon
+    def _to_dict(cls, model, selection):
+        return super(_PathEvent, cls)._to_dict(model, selection) | _pick(
+            model, selection, 'length', 'width', 'start_lat', 'start_lon', 'end_lat', 'end_lon'
         )
 
 
@@ -95,18 +124,9 @@ class TornadoSegment(_PathEvent):
     magnitude: float
     counties: List[County]
 
-    @staticmethod
-    def _extract_counties(model):
-        county_relationships = model.counties
-        return [County.marshal(c.county, c.county_order) for c in county_relationships]
-
     @classmethod
-    def _to_dict(cls, model):
-        print(model.counties)
-        return super(TornadoSegment, cls)._to_dict(model) | dict(
-            magnitude=model.magnitude,
-            counties=TornadoSegment._extract_counties(model)
-        )
+    def _to_dict(cls, model, selection):
+        return super(TornadoSegment, cls)._to_dict(model, selection) | _pick(model, selection, 'magnitude')
 
 
 @strawberry.type
@@ -114,18 +134,35 @@ class Tornado(_PathEvent):
     magnitude: float
     segments: List[TornadoSegment]
 
-    @classmethod
-    def _to_dict(cls, model):
-        return super(Tornado, cls)._to_dict(model) | dict(
-            magnitude=model.magnitude,
-            segments=[TornadoSegment.marshal(ts) for ts in model.segments]
-        )
+    @staticmethod
+    async def _with_segments(tornadoes, selection):
+        # the segments of the whole page (and their counties) are loaded at once, rather than per tornado
+        per_tornado = await load_segments([tornado.id for tornado in tornadoes])
+        with MARSHAL.time(type=TornadoSegment.__name__):
+            for tornado, segments in zip(tornadoes, per_tornado):
+                tornado.segments = [TornadoSegment.marshal(segment, selection) for segment in segments]
+        if 'counties' not in selection:
+            return
+
+        segments = [segment for tornado in tornadoes for segment in tornado.segments]
+        per_segment = await load_segment_counties([segment.id for segment in segments])
+        for segment, counties in zip(segments, per_segment):
+            # counties the cache doesn't have (see `_PointEvent.county`) are left out
+            cached = [(county_cache.get(c.county_id), c.county_order) for c in counties]
+            segment.counties = [County.marshal(county, order) for county, order in cached if county is not None]
 
     @classmethod
-    def fetch(cls, filter: TornadoFilter = None, pagination: Pagination = None):
-        with get_session() as session:
-            queried = TornadoFetch(session).fetch(filter, order_by='datetime', pagination=pagination)
-            return [cls.marshal(event) for event in queried]
+    async def fetch(cls, filter: TornadoFilter, pagination: Pagination, selection: Selection):
+        async def fetch_events():
+            queried = await read_async(lambda session: TornadoFetch(session).fetch_async(
+                filter, order_by='datetime', pagination=pagination, selection=selection))
+            with MARSHAL.time(type=cls.__name__):
+                tornadoes = cls.from_rows(queried)
+            if 'segments' in selection:
+                await cls._with_segments(tornadoes, selection['segments'])
+            return tornadoes
+
+        return await response_cache.get_or_fetch(cls.__name__, (filter, pagination, selection), fetch_events)
 
 
 @strawberry.type
@@ -133,16 +170,14 @@ class Hail(_PointEvent):
     magnitude: float
 
     @classmethod
-    def _to_dict(cls, model):
-        return super(Hail, cls)._to_dict(model) | dict(
-            magnitude=model.magnitude
-        )
+    async def fetch(cls, filter: HailFilter, pagination: Pagination, selection: Selection):
+        async def fetch_events():
+            queried = await read_async(lambda session: HailFetch(session).fetch_async(
+                filter, order_by='datetime', pagination=pagination, selection=selection))
+            with MARSHAL.time(type=cls.__name__):
+                return cls.from_rows(queried)
 
-    @classmethod
-    def fetch(cls, filter: HailFilter = None, pagination: Pagination = None):
-        with get_session() as session:
-            queried = HailFetch(session).fetch(filter, order_by='datetime', pagination=pagination)
-            return [cls.marshal(event) for event in queried]
+        return await response_cache.get_or_fetch(cls.__name__, (filter, pagination, selection), fetch_events)
 
 
 @strawberry.type
@@ -150,28 +185,73 @@ class Wind(_PointEvent):
     magnitude: int
 
     @classmethod
-    def _to_dict(cls, model):
-        return super(Wind, cls)._to_dict(model) | dict(
-            magnitude=model.magnitude
-        )
+    async def fetch(cls, filter: WindFilter, pagination: Pagination, selection: Selection):
+        async def fetch_events():
+            queried = await read_async(lambda session: WindFetch(session).fetch_async(
+                filter, order_by='datetime', pagination=pagination, selection=selection))
+            with MARSHAL.time(type=cls.__name__):
+                return cls.from_rows(queried)
+
+        return await response_cache.get_or_fetch(cls.__name__, (filter, pagination, selection), fetch_events)
+
+
+@strawberry.type
+class EventStats:
+    # group keys, null unless grouped by
+    year: Optional[int]
+    month: Optional[int]
+    hour: Optional[int]
+    state: Optional[str]
+    magnitude: Optional[float]
+
+    count: int
+    fatalities: int
+    injuries: int
+    loss: float
+    closs: float
+    # total path length, tornadoes only
+    length: Optional[float]
+
+    @classmethod
+    def marshal(cls, row):
+        return cls(**_unselected(cls) | {
+            key: float(value) if key in ('loss', 'closs', 'length') else value
+            for key, value in row._mapping.items()
+        })
 
     @classmethod
-    def fetch(cls, filter: WindFilter = None, pagination: Pagination = None):
-        with get_session() as session:
-            queried = WindFetch(session).fetch(filter, order_by='datetime', pagination=pagination)
-            return [cls.marshal(event) for event in queried]
+    async def fetch(cls, fetch_cls, filter, group_by: List[StatsGroupBy]):
+        async def fetch_stats():
+            queried = await read_async(lambda session: fetch_cls(session).fetch_stats_async(filter, group_by))
+            with MARSHAL.time(type=cls.__name__):
+                return [cls.marshal(row) for row in queried]
+
+        return await response_cache.get_or_fetch(f'{fetch_cls.__name__}.stats', (filter, group_by), fetch_stats)
 
 
 @strawberry.type
 class Query:
     @strawberry.field
-    def tornado(self, filter: TornadoFilter = None, pagination: Pagination = None) -> List[Tornado]:
-        return Tornado.fetch(filter, pagination)
+    async def tornado(self, info: Info, filter: TornadoFilter = None, pagination: Pagination = None) -> List[Tornado]:
+        return await Tornado.fetch(filter, pagination, Selection.from_info(info))
+
+    @strawberry.field
+    async def hail(self, info: Info, filter: HailFilter = None, pagination: Pagination = None) -> List[Hail]:
+        return await Hail.fetch(filter, pagination, Selection.from_info(info))
+
+    @strawberry.field
+    async def wind(self, info: Info, filter: WindFilter = None, pagination: Pagination = None) -> List[Wind]:
+        return await Wind.fetch(filter, pagination, Selection.from_info(info))
+
+    @strawberry.field
+    async def tornado_stats(self, filter: TornadoFilter = None,
+                            group_by: List[StatsGroupBy] = None) -> List[EventStats]:
+        return await EventStats.fetch(TornadoFetch, filter, group_by)
 
     @strawberry.field
-    def hail(self, filter: HailFilter = None, pagination: Pagination = None) -> List[Hail]:
-        return Hail.fetch(filter, pagination)
+    async def hail_stats(self, filter: HailFilter = None, group_by: List[StatsGroupBy] = None) -> List[EventStats]:
+        return await EventStats.fetch(HailFetch, filter, group_by)
 
     @strawberry.field
-    def wind(self, filter: WindFilter = None, pagination: Pagination = None) -> List[Wind]:
-        return Wind.fetch(filter, pagination)
+    async def wind_stats(self, filter: WindFilter = None, group_by: List[StatsGroupBy] = None) -> List[EventStats]:
+        return await EventStats.fetch(WindFetch, filter, group_by)
@@ -0,0 +1,108 @@
+import unittest
+
+from sqlalchemy import create_engine, literal, select
+
+from svrdb.geo import BBoxShape, PolygonShape, RadiusShape
+
+engine = create_engine('sqlite://', future=True)
+
+
+def evaluate(predicate, *values):
+    # the predicates build SQL, so run them against bound values
+    with engine.connect() as conn:
+        return bool(conn.execute(select(predicate(*(literal(float(value)) for value in values)))).scalar())
+
+
+class BBoxShapeTest(unittest.TestCase):
+    shape = BBoxShape(35.0, -98.0, 36.0, -97.0)
+
+    def test_contains(self):
+        self.assertTrue(evaluate(self.shape.contains_point, 35.5, -97.5))
+        self.assertTrue(evaluate(self.shape.contains_point, 35.0, -98.0))
+        self.assertFalse(evaluate(self.shape.contains_point, 36.1, -97.5))
+        self.assertFalse(evaluate(self.shape.contains_point, 35.5, -96.9))
+
+    def test_touches_path_starting_inside(self):
+        self.assertTrue(evaluate(self.shape.touches_path, 35.5, -97.5, 37.0, -95.0))
+
+    def test_touches_path_ending_inside(self):
+        self.assertTrue(evaluate(self.shape.touches_path, 34.0, -99.0, 35.5, -97.5))
+
+    def test_touches_path_crossing(self):
+        self.assertTrue(evaluate(self.shape.touches_path, 34.5, -97.5, 36.5, -97.5))
+        self.assertTrue(evaluate(self.shape.touches_path, 34.0, -99.0, 37.0, -96.0))
+
+    def test_touches_path_missing(self):
+        self.assertFalse(evaluate(self.shape.touches_path, 37.0, -99.0, 38.0, -96.0))
+
+    def test_touches_path_diagonal_past_corner(self):
+        # the path's bounding box overlaps the box, but the path itself passes below its corner
+        shape = BBoxShape(35.8, -98.0, 36.0, -97.8)
+        self.assertFalse(evaluate(shape.touches_path, 35.0, -98.0, 36.0, -97.0))
+        corners = [[35.8, -98.0], [35.8, -97.8], [36.0, -97.8], [36.0, -98.0]]
+        self.assertFalse(evaluate(PolygonShape(corners).touches_path, 35.0, -98.0, 36.0, -97.0))
+
+    def test_touches_path_collinear_with_side(self):
+        self.assertTrue(evaluate(self.shape.touches_path, 35.0, -99.0, 35.0, -97.5))
+        self.assertFalse(evaluate(self.shape.touches_path, 35.0, -100.0, 35.0, -99.0))
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            BBoxShape(36.0, -98.0, 35.0, -97.0)
+
+
+class RadiusShapeTest(unittest.TestCase):
+    shape = RadiusShape(35.0, -97.0, 50)
+
+    def test_contains(self):
+        self.assertTrue(evaluate(self.shape.contains_point, 35.0, -97.0))
+        self.assertTrue(evaluate(self.shape.contains_point, 35.4, -97.0))
+        self.assertFalse(evaluate(self.shape.contains_point, 35.5, -97.0))
+        # longitude degrees are shorter at this latitude, but not by that much
+        self.assertFalse(evaluate(self.shape.contains_point, 35.0, -96.4))
+
+    def test_touches_path_passing_by(self):
+        self.assertTrue(evaluate(self.shape.touches_path, 34.0, -97.2, 36.0, -97.2))
+
+    def test_touches_path_missing(self):
+        self.assertFalse(evaluate(self.shape.touches_path, 34.0, -96.0, 36.0, -96.0))
+        # pointing at the center, but ending short of the circle
+        self.assertFalse(evaluate(self.shape.touches_path, 33.0, -97.0, 34.0, -97.0))
+
+    def test_touches_zero_length_path(self):
+        self.assertTrue(evaluate(self.shape.touches_path, 35.1, -97.0, 35.1, -97.0))
+        self.assertFalse(evaluate(self.shape.touches_path, 36.0, -97.0, 36.0, -97.0))
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            RadiusShape(35.0, -97.0, -1)
+
+
+class PolygonShapeTest(unittest.TestCase):
+    shape = PolygonShape([[35.0, -100.0], [35.0, -98.0], [37.0, -99.0]])
+
+    def test_contains(self):
+        self.assertTrue(evaluate(self.shape.contains_point, 35.5, -99.0))
+        self.assertFalse(evaluate(self.shape.contains_point, 36.5, -98.2))
+        self.assertFalse(evaluate(self.shape.contains_point, 34.9, -99.0))
+
+    def test_touches_path_starting_inside(self):
+        self.assertTrue(evaluate(self.shape.touches_path, 35.5, -99.0, 40.0, -90.0))
+
+    def test_touches_path_crossing(self):
+        self.assertTrue(evaluate(self.shape.touches_path, 34.0, -99.0, 36.0, -99.0))
+
+    def test_touches_path_missing(self):
+        self.assertFalse(evaluate(self.shape.touches_path, 36.5, -98.2, 37.0, -97.0))
+
+    def test_touches_path_collinear_with_edge(self):
+        self.assertTrue(evaluate(self.shape.touches_path, 35.0, -101.0, 35.0, -99.0))
+        self.assertFalse(evaluate(self.shape.touches_path, 35.0, -97.0, 35.0, -96.0))
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            PolygonShape([[35.0, -100.0], [35.0, -98.0]])
+
+
+if __name__ == '__main__':
+    unittest.main()